@@ -1,6 +1,5 @@
 import streamlit as st
-import openai
-import requests
+import sys
 import json
 from dotenv import load_dotenv
 import os
@@ -11,6 +10,11 @@ import uuid
 import chardet
 import fitz  # PyMuPDF
 
+# Make the shared sefaria_bot package importable when running from the Tests folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sefaria_bot.transport import get_transport
+from sefaria_bot.llm import LLM_BACKEND, get_gateway
+
 # Set the page configuration first
 st.set_page_config(page_title="Philosophical Ideas Summarizer", layout="wide")
 
@@ -23,20 +27,20 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 # Debugging: Print the API key to check if it's loaded correctly (remove this in production)
 #st.write(f"Loaded API Key: {openai_api_key}")
 
-if not openai_api_key:
+if not openai_api_key and LLM_BACKEND == "openai":
     st.error("OpenAI API key not found. Please set it in the .env file.")
     st.stop()
 
-# Initialize the OpenAI client with the API key
-client = openai.OpenAI(api_key=openai_api_key)
+# Every LLM call goes through the shared gateway (LLM_BACKEND=fake runs without an API key)
+llm = get_gateway(api_key=openai_api_key)
 
 # Sefaria API URL
-SEFARIA_API_URL = "https://www.sefaria.org/api/texts/"
+SEFARIA_API_URL = os.getenv("SEFARIA_API_URL", "https://www.sefaria.org/api/texts/")
 
 # Function to fetch text from Sefaria API
 def fetch_text_from_sefaria(ref):
     url = f"{SEFARIA_API_URL}{ref}"
-    response = requests.get(url)
+    response = get_transport().get(url)
     if response.status_code == 200:
         data = response.json()
         hebrew_text_html = data.get('he', [])
@@ -76,44 +80,25 @@ def call_openai_api_with_memory(conversation_id, role, content, temperature=0.5)
 
     conversation_history[conversation_id].append({"role": role, "content": content})
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=conversation_history[conversation_id],
-        max_tokens=1500,
-        temperature=temperature
-    )
-
-    response_message = completion.choices[0].message.content.strip()
+    response_message = llm.complete(conversation_history[conversation_id], temperature)
     conversation_history[conversation_id].append({"role": "assistant", "content": response_message})
 
     return response_message
 
 # Function to translate text using GPT
 def translate_text(text,temperature=0.0):
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are a professional hebrew translating bot."},
-            {"role": "user", "content": f"Translate the following text to english:\n{text}. Translate word for word and do not interpret anything. Aswer only with your translation"}
-        ],
-        max_tokens=1500,
-        temperature=temperature
-    )
-    translation = completion.choices[0].message.content.strip()
+    translation = llm.complete([
+        {"role": "system", "content": "You are a professional hebrew translating bot."},
+        {"role": "user", "content": f"Translate the following text to english:\n{text}. Translate word for word and do not interpret anything. Aswer only with your translation"}
+    ], temperature)
     return translation
 
 # Function to turn text to native speaker level using GPT
 def native_text(text, temperature=0.):
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are a professional translating bot."},
-            {"role": "user", "content": f"Improve the following text to native speaker level:\n{text}. Do not change anything to the meaning. Aswer only with the updated text, do not say anything else"}
-        ],
-        max_tokens=1500,
-        temperature=temperature
-    )
-    native = completion.choices[0].message.content.strip()
+    native = llm.complete([
+        {"role": "system", "content": "You are a professional translating bot."},
+        {"role": "user", "content": f"Improve the following text to native speaker level:\n{text}. Do not change anything to the meaning. Aswer only with the updated text, do not say anything else"}
+    ], temperature)
     return native
 
 # 0. Understanding Text
@@ -0,0 +1,65 @@
+import os
+import random
+import re
+import sys
+import timeit
+import unicodedata
+
+from bs4 import BeautifulSoup
+
+# Make the shared sefaria_bot package importable when running from the Tests folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sefaria_bot.cleaning import clean_hebrew_text
+
+
+# The cleaning that fetch_text_from_sefaria used to do inline, kept here as the reference
+def reference_clean_hebrew_text(hebrew_text_html):
+    hebrew_text = BeautifulSoup(' '.join(hebrew_text_html), "html.parser").get_text(separator=' ')
+    hebrew_text = unicodedata.normalize('NFKD', hebrew_text)
+    hebrew_text = hebrew_text.replace('\xa0', ' ')
+    hebrew_text = re.sub(r'\s+', ' ', hebrew_text).strip()
+    hebrew_text = re.sub(r'[\u200B-\u200D\uFEFF]', '', hebrew_text)
+    hebrew_text = ''.join(c for c in hebrew_text if unicodedata.category(c)[0] != 'C')
+    return hebrew_text
+
+
+HEBREW_WORDS = ['בְּרֵאשִׁית', 'בָּרָא', 'אֱלֹהִים', 'וְהָאָרֶץ', 'הָיְתָה', 'תֹהוּ', 'קוּדְשָׁא', 'בְּרִיךְ', 'הוּא', 'וּשְׁכִינְתֵּיהּ', 'זֹהַר']
+DECORATIONS = ['<b>{}</b>', '<i>{}</i>', '<small>{}</small>', '<span class="mam-spi-pe">{}</span>', '{}&nbsp;', '{}\u200d', '\u200f{}',
+               '{}<br>', '<sup class="footnote-marker">*</sup><i class="footnote">{}</i>', '{}\xa0', '{} &amp; ', '{}\t\n', '{}<!-- note -->']
+
+
+# A Sefaria-like segment: pointed Hebrew words with the markup and invisible characters Sefaria sends
+def random_segment(rng, words):
+    parts = []
+    for _ in range(words):
+        word = rng.choice(HEBREW_WORDS)
+        if rng.random() < 0.3:
+            word = rng.choice(DECORATIONS).format(word)
+        parts.append(word)
+    return ' '.join(parts)
+
+
+def main():
+    rng = random.Random(0)
+
+    # Same output as the old pipeline, character for character
+    for _ in range(2000):
+        segments = [random_segment(rng, rng.randint(0, 12)) for _ in range(rng.randint(0, 4))]
+        expected = reference_clean_hebrew_text(segments)
+        assert clean_hebrew_text(segments) == expected, segments
+
+    # Roughly the size of a full Tikkunei Zohar daf
+    daf = [random_segment(rng, 120) for _ in range(40)]
+    assert clean_hebrew_text(daf) == reference_clean_hebrew_text(daf)
+    print(f"daf: {len(daf)} segments, {sum(map(len, daf))} characters")
+
+    runs = 20
+    old = min(timeit.repeat(lambda: reference_clean_hebrew_text(daf), number=runs, repeat=5)) / runs
+    new = min(timeit.repeat(lambda: clean_hebrew_text(daf), number=runs, repeat=5)) / runs
+    print(f"BeautifulSoup pipeline: {old * 1000:.2f} ms")
+    print(f"sefaria_bot.cleaning:   {new * 1000:.2f} ms")
+    print(f"speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
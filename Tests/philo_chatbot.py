@@ -1,10 +1,14 @@
 import streamlit as st
-import openai
+import sys
 import uuid
 from translation_analysis import fetch_text_from_sefaria, perform_analysis
 from dotenv import load_dotenv
 import os
 
+# Make the shared sefaria_bot package importable when running from the Tests folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sefaria_bot.llm import LLM_BACKEND, get_gateway
+
 # Set the page configuration
 st.set_page_config(page_title="Philosophical Ideas Summarizer", layout="wide")
 
@@ -14,12 +18,12 @@ load_dotenv()
 # Get the OpenAI API key from environment variables
 openai_api_key = os.getenv("OPENAI_API_KEY")
 
-if not openai_api_key:
+if not openai_api_key and LLM_BACKEND == "openai":
     st.error("OpenAI API key not found. Please set it in the .env file.")
     st.stop()
 
-# Initialize OpenAI client
-client = openai.OpenAI(api_key=openai.api_key)
+# Every LLM call goes through the shared gateway (LLM_BACKEND=fake runs without an API key)
+client = get_gateway(api_key=openai_api_key)
 
 
 # Generate a unique conversation ID
@@ -84,16 +88,10 @@ if 'analysis' in st.session_state:
             context = st.session_state['analysis'] + "\n\n" + user_question
 
             # Call to the OpenAI API to get a response
-            response = completion = client.chat.completions.create(
-                model="gpt-3.5-turbo",  # Or use another model like "gpt-4"
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": context}
-                ]
-            )
-
-            # Extract the response text
-            chatbot_response = response['choices'][0]['message']['content'].strip()
+            chatbot_response = client.complete([
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": context}
+            ], 1, client.policy_for(model="gpt-3.5-turbo"))  # Or use another model like "gpt-4"
 
             # Display the chatbot's response
             st.write(f"**Chatbot:** {chatbot_response}")
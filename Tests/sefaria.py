@@ -1,14 +1,19 @@
 import streamlit as st
-import requests
+import os
+import sys
 from bs4 import BeautifulSoup
 
+# Make the shared sefaria_bot package importable when running from the Tests folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sefaria_bot.transport import get_transport
+
 # Sefaria API URL
-SEFARIA_API_URL = "https://www.sefaria.org/api/texts/"
+SEFARIA_API_URL = os.getenv("SEFARIA_API_URL", "https://www.sefaria.org/api/texts/")
 
 # Function to fetch text from Sefaria API (Hebrew)
 def he_fetch_text_from_sefaria(ref):
     url = f"{SEFARIA_API_URL}{ref}"
-    response = requests.get(url)
+    response = get_transport().get(url)
     if response.status_code == 200:
         data = response.json()
         hebrew_text_html = data.get('he', [])
@@ -27,7 +32,7 @@ def he_fetch_text_from_sefaria(ref):
 # Function to fetch text from Sefaria API (English)
 def en_fetch_text_from_sefaria(ref):
     url = f"{SEFARIA_API_URL}{ref}"
-    response = requests.get(url)
+    response = get_transport().get(url)
     if response.status_code == 200:
         data = response.json()
         english_text = data.get('text', [])
@@ -1,5 +1,4 @@
-import openai
-import requests
+import sys
 from bs4 import BeautifulSoup
 import unicodedata
 import re
@@ -7,12 +6,16 @@ import json
 from dotenv import load_dotenv
 import os
 
+# Make the shared sefaria_bot package importable when running from the Tests folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sefaria_bot.transport import get_transport
+
 
 # Function to fetch text from Sefaria API
 def fetch_text_from_sefaria(ref):
-    SEFARIA_API_URL = "https://www.sefaria.org/api/texts/"
+    SEFARIA_API_URL = os.getenv("SEFARIA_API_URL", "https://www.sefaria.org/api/texts/")
     url = f"{SEFARIA_API_URL}{ref}"
-    response = requests.get(url)
+    response = get_transport().get(url)
     if response.status_code == 200:
         data = response.json()
         hebrew_text_html = data.get('he', [])
@@ -51,44 +54,25 @@ def call_openai_api_with_memory(client, conversation_id, role, content, temperat
 
     conversation_history[conversation_id].append({"role": role, "content": content})
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=conversation_history[conversation_id],
-        max_tokens=1500,
-        temperature=temperature
-    )
-
-    response_message = completion.choices[0].message.content.strip()
+    response_message = client.complete(conversation_history[conversation_id], temperature)
     conversation_history[conversation_id].append({"role": "assistant", "content": response_message})
 
     return response_message
 
 # Function to translate text using GPT
 def translate_text(client, text,temperature=0.0):
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are a professional hebrew translating bot."},
-            {"role": "user", "content": f"Translate the following text to english:\n{text}. Translate word for word and do not interpret anything. Aswer only with your translation"}
-        ],
-        max_tokens=1500,
-        temperature=temperature
-    )
-    translation = completion.choices[0].message.content.strip()
+    translation = client.complete([
+        {"role": "system", "content": "You are a professional hebrew translating bot."},
+        {"role": "user", "content": f"Translate the following text to english:\n{text}. Translate word for word and do not interpret anything. Aswer only with your translation"}
+    ], temperature)
     return translation
 
 # Function to turn text to native speaker level using GPT
 def native_text(client, text, temperature=0.):
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are a professional translating bot."},
-            {"role": "user", "content": f"Improve the following text to native speaker level:\n{text}. Do not change anything to the meaning. Aswer only with the updated text, do not say anything else"}
-        ],
-        max_tokens=1500,
-        temperature=temperature
-    )
-    native = completion.choices[0].message.content.strip()
+    native = client.complete([
+        {"role": "system", "content": "You are a professional translating bot."},
+        {"role": "user", "content": f"Improve the following text to native speaker level:\n{text}. Do not change anything to the meaning. Aswer only with the updated text, do not say anything else"}
+    ], temperature)
     return native
 
 # 0. Understanding Text
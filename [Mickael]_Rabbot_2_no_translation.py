@@ -1,14 +1,14 @@
 import streamlit as st
-import openai
-import requests
 import json
-from dotenv import load_dotenv
 import os
 from bs4 import BeautifulSoup
 import re
-import unicodedata
 import uuid
-from PIL import Image
+from sefaria_bot.refs import InvalidRef, book_ref
+from sefaria_bot.sefaria import fetch_bilingual_text
+from sefaria_bot.analysis_cache import analysis_key, get_analysis_cache
+from sefaria_bot.llm import LLM_BACKEND, get_gateway
+from sefaria_bot.resources import get_asset, get_config, get_image
 #from streamlit_extras.app_logo import add_logo
 #import chardet
 #import fitz  # PyMuPDF
@@ -20,21 +20,24 @@ from PIL import Image
 ############################ Setting up Page ############################
 
 # Set the page configuration first
-im = Image.open("UI/Assets/favicon.ico")
+im = get_image("UI/Assets/favicon.ico")
 st.set_page_config(page_title="Talmud Analysis Web Tool", page_icon=im,layout="wide")
 
-# Load environment variables from .env file
-load_dotenv()
+# Settings are read (and the .env file loaded) once per process, not on every rerun
+config = get_config()
 
 # Get the OpenAI API key from environment variables
-openai_api_key = os.getenv("OPENAI_API_KEY") or st.secrets["OPENAI_API_KEY"]
+openai_api_key = config.openai_api_key or (st.secrets["OPENAI_API_KEY"] if LLM_BACKEND == "openai" else None)
 
-if not openai_api_key:
+if not openai_api_key and LLM_BACKEND == "openai":
     st.error("OpenAI API key not found. Please set it in the .env file.")
     st.stop()
 
-# Initialize the OpenAI client with the API key
-client = openai.OpenAI(api_key=openai_api_key)
+# Every LLM call goes through the shared gateway (LLM_BACKEND=fake runs without an API key)
+llm = get_gateway(api_key=openai_api_key)
+
+# Section answers shared by every session and app process
+analysis_cache = get_analysis_cache()
 
 # Initialise session state
 if 'interaction' not in st.session_state:
@@ -50,7 +53,7 @@ if 'interaction' not in st.session_state:
 
 # Initialize the Streamlit app
 #add_logo("../[Sefaria_Bot]_2_UI/Assets/[Sefaria_Bot]_Spait_logo_no_backgound.jpeg", height=300)
-st.image("UI/Assets/[Sefaria_Bot]_Spait_logo_no_backgound.jpeg", width=100)
+st.image(get_asset("UI/Assets/[Sefaria_Bot]_Spait_logo_no_backgound.jpeg"), width=100)
 
 
 st.title("Talmud Analysis Web Tool")
@@ -65,83 +68,29 @@ st.write('')
 ############################ Functions ############################
 
 
-# Sefaria API URL
-SEFARIA_API_URL = "https://www.sefaria.org/api/texts/"
-
 #@st.cache_data
-# Function to fetch text from Sefaria API
-def he_fetch_text_from_sefaria(ref):
-    url = f"{SEFARIA_API_URL}{ref}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        hebrew_text_html = data.get('he', [])
-
-        # Joining the list to form a single string before cleaning HTML tags
-        hebrew_text = BeautifulSoup(' '.join(hebrew_text_html), "html.parser").get_text(separator=' ')
-
-        # Normalize the text to remove special characters
-        #hebrew_text = unicodedata.normalize('NFKD', hebrew_text)
-
-        # Remove non-breaking spaces and other special characters
-        #hebrew_text = hebrew_text.replace('\xa0', ' ')
-
-        # Remove non-standard whitespace characters
-        #hebrew_text = re.sub(r'\s+', ' ', hebrew_text).strip()
-
-        # Remove zero-width spaces and other control characters
-        #hebrew_text = re.sub(r'[\u200B-\u200D\uFEFF]', '', hebrew_text)
-
-        # Remove any remaining non-printable characters
-        #hebrew_text = ''.join(c for c in hebrew_text if unicodedata.category(c)[0] != 'C')
+# Function to fetch the Hebrew text and its English version from Sefaria API in a single request
+def fetch_text_from_sefaria(ref):
+    bundle = fetch_bilingual_text(ref)
+    if bundle is not None:
+        # Cleaning HTML tags from each language
+        hebrew_text = BeautifulSoup(' '.join(bundle.he), "html.parser").get_text(separator=' ')
+        english_text = BeautifulSoup(' '.join(bundle.en), "html.parser").get_text(separator=' ')
 
         # Save to session state
         st.session_state['hebrew_text'] = hebrew_text
-        return st.session_state['hebrew_text']
-    else:
-        st.error("Failed to fetch the text")
-        st.session_state['hebrew_text'] = "Failed to fetch the text"
-        return st.session_state['hebrew_text']
-
-def en_fetch_text_from_sefaria(ref):
-    url = f"{SEFARIA_API_URL}{ref}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        english_text_html = data.get('text', [])
-
-        # Joining the list to form a single string before cleaning HTML tags
-        english_text = BeautifulSoup(' '.join(english_text_html), "html.parser").get_text(separator=' ')
-
-        # Normalize the text to remove special characters
-        #english_text = unicodedata.normalize('NFKD', english_text)
-
-        # Remove non-breaking spaces and other special characters
-        #english_text = english_text.replace('\xa0', ' ')
-
-        # Remove non-standard whitespace characters
-        #english_text = re.sub(r'\s+', ' ', english_text).strip()
-
-        # Remove zero-width spaces and other control characters
-        #english_text = re.sub(r'[\u200B-\u200D\uFEFF]', '', english_text)
-
-        # Remove any remaining non-printable characters
-        #english_text = ''.join(c for c in english_text if unicodedata.category(c)[0] != 'C')
-
-        # Save to session state
         st.session_state['english_text'] = english_text
-        return st.session_state['english_text']
+        st.session_state['text_versions'] = (bundle.he_version, bundle.en_version)
+        return st.session_state['hebrew_text'], st.session_state['english_text']
     else:
         st.error("Failed to fetch the text")
         st.session_state['hebrew_text'] = "Failed to fetch the text"
-        return st.session_state['english_text']
+        st.session_state['english_text'] = "Failed to fetch the text"
+        return st.session_state['hebrew_text'], st.session_state['english_text']
 
 
-# General function to call OpenAI API with memory
-def call_openai_api_with_memory(conversation_id, role, content, temperature):
-    if conversation_id not in st.session_state['conversation_history']:
-        st.session_state['conversation_history'][conversation_id] = [
-            {"role": "system", "content": '''#CONTEXT:
+# System prompts of the Copilot and of its conversation starters
+RABBI_SYSTEM_PROMPT = '''#CONTEXT:
 You are helping students understand a complex philosophical work by making it more accessible to them.
 
 #ROLE:
@@ -156,29 +105,9 @@ You are an English-speaking Jewish Orthodox rabbi.
 - God should always be G-d
 - Hebrew names should be used (if possible); so Moses is Moshe, Aaron is Aharon
 - From the analysis remove anything which implies like we're evaluating the work, that would be inappropriate. It's not for us to judge, just to learn and apply
-- The usage in English translations of Moshe or Aharon instead of Moses or Aaron is called transliteration. Transliteration is the process of transferring a word from one alphabet or writing system to another, typically by representing each letter or character with a corresponding one from the target language. In this case, "Moshe" and "Aharon" are transliterations of the Hebrew names "מֹשֶׁה" and "אַהֲרֹן", respectively, using the Latin alphabet. Always transliterate all the names.'''}
-        ]
-
-    st.session_state['conversation_history'][conversation_id].append({"role": role, "content": content})
-
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=st.session_state['conversation_history'][conversation_id],
-        max_tokens=1500,
-        temperature=temperature
-    )
-
-    response_message = completion.choices[0].message.content.strip()
-    st.session_state['conversation_history'][conversation_id].append({"role": "assistant", "content": response_message})
+- The usage in English translations of Moshe or Aharon instead of Moses or Aaron is called transliteration. Transliteration is the process of transferring a word from one alphabet or writing system to another, typically by representing each letter or character with a corresponding one from the target language. In this case, "Moshe" and "Aharon" are transliterations of the Hebrew names "מֹשֶׁה" and "אַהֲרֹן", respectively, using the Latin alphabet. Always transliterate all the names.'''
 
-    return response_message
-
-
-# Texts function to call OpenAI API with memory
-def texts_call_openai_api_with_memory(conversation_id, role, content, temperature):
-    if conversation_id not in st.session_state['conversation_history']:
-        st.session_state['conversation_history'][conversation_id] = [
-            {"role": "system", "content": '''#CONTEXT:
+TEXTS_SYSTEM_PROMPT = '''#CONTEXT:
 You are an expert in Jewish texts and the Talmud. Your task is to help students expand their learning and engage in more in-depth analysis of Talmudic texts.
 
 #ROLE:
@@ -196,27 +125,9 @@ As a knowledgeable guide and mentor, your role is to suggest related texts from
 2. Prioritize texts that offer new insights or challenge conventional interpretations
 3. Consider the student's level of knowledge when selecting texts
 4. Avoid suggesting texts that are too complex or require extensive background knowledge
-5. Focus on texts that will stimulate critical thinking and encourage deeper engagement with the material'''}]
-
-    st.session_state['conversation_history'][conversation_id].append({"role": role, "content": content})
-
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=st.session_state['conversation_history'][conversation_id],
-        max_tokens=1500,
-        temperature=temperature
-    )
+5. Focus on texts that will stimulate critical thinking and encourage deeper engagement with the material'''
 
-    response_message = completion.choices[0].message.content.strip()
-    st.session_state['conversation_history'][conversation_id].append({"role": "assistant", "content": response_message})
-
-    return response_message
-
-# Movie function to call OpenAI API with memory
-def movie_call_openai_api_with_memory(conversation_id, role, content, temperature):
-    if conversation_id not in st.session_state['conversation_history']:
-        st.session_state['conversation_history'][conversation_id] = [
-            {"role": "system", "content": '''#CONTEXT:
+MOVIE_SYSTEM_PROMPT = '''#CONTEXT:
 You are an expert in Jewish philosophy and are tasked with explaining a complex Jewish philosophical text to a student who is struggling to understand it. To make the concepts more relatable and easier to grasp, you decide to use a movie metaphor to illustrate the key ideas.
 
 #ROLE:
@@ -237,27 +148,9 @@ You will take on the role of a wise and knowledgeable teacher who is skilled at
 4. Encourage critical thinking and personal interpretation, rather than presenting a single, definitive explanation.
 
 #RESPONSE FORMAT:
-Provide the explanation in clear, concise paragraphs, using italics to highlight key terms or concepts. Use line breaks to separate different sections or ideas, and consider using bullet points to list important parallels or connections between the movie and the philosophical text.'''}]
-
-    st.session_state['conversation_history'][conversation_id].append({"role": role, "content": content})
-
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=st.session_state['conversation_history'][conversation_id],
-        max_tokens=1500,
-        temperature=temperature
-    )
+Provide the explanation in clear, concise paragraphs, using italics to highlight key terms or concepts. Use line breaks to separate different sections or ideas, and consider using bullet points to list important parallels or connections between the movie and the philosophical text.'''
 
-    response_message = completion.choices[0].message.content.strip()
-    st.session_state['conversation_history'][conversation_id].append({"role": "assistant", "content": response_message})
-
-    return response_message
-
-# Song function to call OpenAI API with memory
-def song_call_openai_api_with_memory(conversation_id, role, content, temperature):
-    if conversation_id not in st.session_state['conversation_history']:
-        st.session_state['conversation_history'][conversation_id] = [
-            {"role": "system", "content": '''#CONTEXT:
+SONG_SYSTEM_PROMPT = '''#CONTEXT:
 You are a creative songwriter tasked with creating an engaging and educational song about a complex Jewish philosophical text to help students better understand the material.
 
 #ROLE:
@@ -300,22 +193,56 @@ Bridge (optional):
 Chorus:
 [LYRICS]
 
-'''}]
+'''
 
-    st.session_state['conversation_history'][conversation_id].append({"role": role, "content": content})
+# Function to call the LLM with the conversation memory of the session
+def chat_with_memory(conversation_id, system_prompt, role, content, temperature):
+    if conversation_id not in st.session_state['conversation_history']:
+        st.session_state['conversation_history'][conversation_id] = [{"role": "system", "content": system_prompt}]
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=st.session_state['conversation_history'][conversation_id],
-        max_tokens=1500,
-        temperature=temperature
-    )
+    st.session_state['conversation_history'][conversation_id].append({"role": role, "content": content})
 
-    response_message = completion.choices[0].message.content.strip()
+    response_message = llm.complete(st.session_state['conversation_history'][conversation_id], temperature)
     st.session_state['conversation_history'][conversation_id].append({"role": "assistant", "content": response_message})
 
     return response_message
 
+# General function to call OpenAI API with memory
+def call_openai_api_with_memory(conversation_id, role, content, temperature):
+    return chat_with_memory(conversation_id, RABBI_SYSTEM_PROMPT, role, content, temperature)
+
+# Texts function to call OpenAI API with memory
+def texts_call_openai_api_with_memory(conversation_id, role, content, temperature):
+    return chat_with_memory(conversation_id, TEXTS_SYSTEM_PROMPT, role, content, temperature)
+
+# Movie function to call OpenAI API with memory
+def movie_call_openai_api_with_memory(conversation_id, role, content, temperature):
+    return chat_with_memory(conversation_id, MOVIE_SYSTEM_PROMPT, role, content, temperature)
+
+# Song function to call OpenAI API with memory
+def song_call_openai_api_with_memory(conversation_id, role, content, temperature):
+    return chat_with_memory(conversation_id, SONG_SYSTEM_PROMPT, role, content, temperature)
+
+# Version of this app's section prompts, part of their keys in the analysis cache: bump it when a prompt changes
+SECTION_PROMPTS_VERSION = 1
+
+# Function to answer a section with the conversation memory of the session, from the shared analysis cache when another
+# session asked the same section at the same point of the same conversation. Sections here build on whatever the student
+# opened before, so the conversation so far is part of the key
+def section_with_memory(conversation_id, key, ref, content, temperature):
+    history = st.session_state['conversation_history'].setdefault(conversation_id, [{"role": "system", "content": RABBI_SYSTEM_PROMPT}])
+    cache_key = analysis_key(ref, f"no_translation:{key}", SECTION_PROMPTS_VERSION, llm.policy.model, temperature,
+                             json.dumps(history, ensure_ascii=False), content)
+    answer = analysis_cache.get(cache_key)
+    if answer is None:
+        answer = call_openai_api_with_memory(conversation_id, "user", content, temperature)
+        analysis_cache.put(cache_key, ref, key, answer)
+    else:
+        history.append({"role": "user", "content": content})
+        history.append({"role": "assistant", "content": answer})
+    st.session_state[key] = answer
+    return answer
+
 # @st.cache_data
 # # Function to translate text using GPT
 # def translate_native_text(conversation_id, text, temperature=0.5):
@@ -329,7 +256,6 @@ Chorus:
 #     st.session_state['translation'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
 #     return st.session_state['translation']
 
-@st.cache_data
 # Summary
 def summary_text(conversation_id, ref, temperature=1):
     content = f'''#CONTEXT:
@@ -343,8 +269,7 @@ The task is to analyze a given text and provide a brief overview focusing on the
 3. Use emojis throughout the overview to make it more engaging and fun.
 4. Avoid using emojis in any further interactions beyond the overview.
 5. Answer only with the overview, without adding any additional information or explanations.'''
-    st.session_state['summary'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['summary']
+    return section_with_memory(conversation_id, 'summary', ref, content, temperature)
 
 # @st.cache_data
 # # Summary
@@ -353,28 +278,21 @@ The task is to analyze a given text and provide a brief overview focusing on the
 #     st.session_state['summary'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
 #     return st.session_state['summary']
 
-@st.cache_data
 # Backround Information
 def background_text(conversation_id, ref, temperature=1):
     content = f"This Section is called 'Background Information'. Provide some background to the text '{ref}'. Always provide new information, never repeat what you have said i nprevious sections. Answer only with the backgound information, do not say anything else."
-    st.session_state['background'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['background']
+    return section_with_memory(conversation_id, 'background', ref, content, temperature)
 
-@st.cache_data
 # Breakdown of Key Sections
 def breakdown_text(conversation_id, ref, temperature=1):
     content = f"This Section is called 'Breakdown of Key Sections'. Identify key sections or {ref} and for each do the following: 1. Main Idea: Summarize the main idea in 1-2 sentences. 2. Important Terminology or Concepts: Identify and define any crucial terminology or concepts introduced. 3. Relation to Overall Argument: Explain how this section or argument contributes to the overall thesis of the text."
-    st.session_state['breakdown'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['breakdown']
+    return section_with_memory(conversation_id, 'breakdown', ref, content, temperature)
 
-@st.cache_data
 # Simplifying Challenging Passages
 def simplify_text(conversation_id, ref, passage, temperature=1):
     content = f"This is Section is called 'Simplification of Challenging Passages'. The user finds this difficult: {passage} in the text {ref}. Locate the appropriate passage in the text and provide simplified explanations to aid understanding. Only answer with the explanations, do not say anything else."
-    st.session_state['simplify'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['simplify']
+    return section_with_memory(conversation_id, 'simplify', ref, content, temperature)
 
-@st.cache_data
 # Identify Core Arguments
 def identify_text(conversation_id, ref, temperature=1):
     content = f'''This Section is called 'Identification and Summary of Core Arguments'
@@ -385,17 +303,13 @@ def identify_text(conversation_id, ref, temperature=1):
 4. Avoid going into excessive detail or tangents unrelated to the core arguments
 5. Use clear and concise language that is accessible to readers with varying levels of familiarity with Jewish philosophy
 '''
-    st.session_state['identify'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['identify']
+    return section_with_memory(conversation_id, 'identify', ref, content, temperature)
 
-@st.cache_data
 # Logical Connections and Flow
 def flow_text(conversation_id, ref, temperature=0.5):
     content = f"This Section is called 'Logical Connections Between Core Arguments'. Trace and elucidate the logical flow that binds the arguments presented in the text {ref}, noting how each premise builds upon the other and the logical operations employed (e.g., deduction, induction). Do not say what you have done. Do not repeat what you have said before."
-    st.session_state['flow'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['flow']
+    return section_with_memory(conversation_id, 'flow', ref, content, temperature)
 
-@st.cache_data
 # Criticize Core Arguments
 def criticize_text(conversation_id, ref, temperature=0.5):
     content = f'''This Section is called 'Criticism of Core Arguments'
@@ -420,10 +334,8 @@ def criticize_text(conversation_id, ref, temperature=0.5):
     - Use proper formatting for any quotes or references to the original text
     - Maintain a professional and scholarly tone throughout the analysis
 '''
-    st.session_state['criticism'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['criticism']
+    return section_with_memory(conversation_id, 'criticism', ref, content, temperature)
 
-@st.cache_data
 # Provide Alternative Viewpoints
 def counter_text(conversation_id, ref,  temperature=0.5):
     content = f'''This Section is called 'Alternate Viewpoints'
@@ -435,10 +347,8 @@ def counter_text(conversation_id, ref,  temperature=0.5):
  Consider the text's place within the broader context of Jewish thought and its relationship to other Jewish philosophical works.
 - Avoid imposing modern or non-Jewish philosophical frameworks onto the text; instead, strive to understand it on its own terms and within its historical and cultural context.
 - Engage with the text critically and analytically, but also with respect and sensitivity to its religious and cultural significance.'''
-    st.session_state['counter'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['counter']
+    return section_with_memory(conversation_id, 'counter', ref, content, temperature)
 
-@st.cache_data
 # Impact on Philosophical Thought
 def impact_text(conversation_id, ref, temperature=0.5):
     content = f'''This Section is called 'Impact of the Text on Philosophical Thought'
@@ -462,8 +372,7 @@ def impact_text(conversation_id, ref, temperature=0.5):
 - Provide a brief introduction outlining the text's main themes and arguments
 - Dedicate separate sections to discussing the text's philosophical contributions, implications, and impact
 - Conclude with a summary of your overall assessment and the text's significance in Jewish philosophical thought'''
-    st.session_state['impact'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['impact']
+    return section_with_memory(conversation_id, 'impact', ref, content, temperature)
 
 
 
@@ -669,21 +578,21 @@ with col2:
     chapter = st.text_input("Chapter number")
 
 
-if book == 'Tikkunei Zohar' and 'a' not in chapter and 'b' not in chapter and 'c' not in chapter:
-    ref = 'Tikkunei_Zohar'+', '+chapter+'a'
-else:
-    ref = 'Tikkunei_Zohar'+', '+chapter
-
-if book == 'Shev Shmateta':
-    ref = 'Shev_Shmateta'+', '+'Shmatta '+chapter
-
-if book == 'Genesis':
-    ref = 'Genesis'+', '+chapter
+# Canonical ref of the chosen chapter, shared with every cache
+try:
+    ref = book_ref(book, chapter).canonical
+    ref_error = None
+except InvalidRef as e:
+    ref = ''
+    ref_error = str(e)
 
 #with col1:
 if st.button("Fetch and Translate"):
         #st.write(ref)  # Debugging: Check if the button press is registered
-        if ref != st.session_state['ref']:
+        if ref_error is not None:
+            # Invalid chapters are rejected before any call to Sefaria
+            st.error(ref_error)
+        elif ref != st.session_state['ref']:
             st.session_state['summary_expander_open'] = False
             st.session_state['summary'] = ''
             st.session_state['background_expander_open'] = False
@@ -706,13 +615,13 @@ if st.button("Fetch and Translate"):
             st.session_state['Fetch']  = True
 
         #if ref:
-            he_fetch_text_from_sefaria(ref)
-            en_fetch_text_from_sefaria(ref)
+            fetch_text_from_sefaria(ref)
             #translate_native_text(st.session_state['conversation_id'], st.session_state['hebrew_text'])
             st.session_state['ref']  = ref
             #st.session_state['Text'] = 'Text'
             #st.session_state['Translation'] = 'Translation'
-        st.rerun()
+        if ref_error is None:
+            st.rerun()
 
 
 # Create two columns
@@ -1,14 +1,21 @@
 import streamlit as st
-import openai
-import requests
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import json
-from dotenv import load_dotenv
 import os
-from bs4 import BeautifulSoup
-import re
-import unicodedata
 import uuid
-from PIL import Image
+import time
+from sefaria_bot.books import BOOKS
+from sefaria_bot.refs import InvalidRef, book_ref
+from sefaria_bot.sefaria import fetch_segmented_text
+from sefaria_bot.analysis import ParagraphPipe, TextAnalysis, run_pipelined_translation, run_rewrite, run_step
+from sefaria_bot.analysis_cache import get_analysis_cache
+from sefaria_bot.history import MESSAGE_OVERHEAD_TOKENS, ConversationHistory, count_tokens
+from sefaria_bot.jobs import get_job_table
+from sefaria_bot.llm import LLM_BACKEND, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, get_gateway
+from sefaria_bot.metrics import get_metrics
+from sefaria_bot.sections import ANALYZE_ALL_SECTIONS, BASE_SECTIONS, RABBI_SYSTEM_PROMPT, SECTIONS
+from sefaria_bot.resources import get_asset, get_config, get_image
 #from streamlit_extras.app_logo import add_logo
 #import chardet
 #import fitz  # PyMuPDF
@@ -20,21 +27,30 @@ from PIL import Image
 ############################ Setting up Page ############################
 
 # Set the page configuration first
-im = Image.open("UI/Assets/favicon.ico")
+im = get_image("UI/Assets/favicon.ico")
 st.set_page_config(page_title="Lomdai Analysis Tool", page_icon=im,layout="wide")
 
-# Load environment variables from .env file
-load_dotenv()
+# Settings are read (and the .env file loaded) once per process, not on every rerun
+config = get_config()
 
 # Get the OpenAI API key from environment variables
-openai_api_key = os.getenv("OPENAI_API_KEY") or st.secrets["OPENAI_API_KEY"]
+openai_api_key = config.openai_api_key or (st.secrets["OPENAI_API_KEY"] if LLM_BACKEND == "openai" else None)
 
-if not openai_api_key:
+if not openai_api_key and LLM_BACKEND == "openai":
     st.error("OpenAI API key not found. Please set it in the .env file.")
     st.stop()
 
-# Initialize the OpenAI client with the API key
-client = openai.OpenAI(api_key=openai_api_key)
+# Every LLM call goes through the shared gateway (LLM_BACKEND=fake runs without an API key)
+llm = get_gateway(api_key=openai_api_key)
+
+# Analysis answers shared by every session (keyed by ref, section, model and text, not by conversation)
+analysis_cache = get_analysis_cache()
+
+# Timings, tokens and cost of every call, for the /metrics endpoint and the event log
+metrics = get_metrics()
+
+# Analysis steps run as background jobs of the session, so a click that reruns the script doesn't throw away an answer in progress
+jobs = get_job_table()
 
 # Initialise session state
 if 'interaction' not in st.session_state:
@@ -44,13 +60,25 @@ if 'interaction' not in st.session_state:
     # Initialize the conversation history
     conversation_history = {}
     st.session_state['conversation_history'] = conversation_history
+    # Prompt, cached, output and saved input tokens of every call, and its time to first token when streamed
+    st.session_state['token_usage'] = []
+    # Steps asked for and not answered yet: key -> how to run it (temperature, priority, prompt values); each runs as a job of the
+    # session in the job table once its inputs are answered
+    st.session_state['pending_sections'] = {}
+    # Why a step could not be generated, shown in its place until it is asked for again
+    st.session_state['section_errors'] = {}
     # Switch off
     st.session_state['interaction'] = ''
 
+# The session's jobs are cancelled once its browser tab is gone (there is no session to watch in bare mode)
+if runtime.exists():
+    session_id = get_script_run_ctx().session_id
+    jobs.watch(st.session_state['conversation_id'], lambda: runtime.get_instance().is_active_session(session_id))
+
 
 # Initialize the Streamlit app
 #add_logo("../[Sefaria_Bot]_2_UI/Assets/[Sefaria_Bot]_Spait_logo_no_backgound.jpeg", height=300)
-st.image("UI/Assets/[Sefaria_Bot]_Spait_logo_no_backgound.jpeg", width=100)
+st.image(get_asset("UI/Assets/[Sefaria_Bot]_Spait_logo_no_backgound.jpeg"), width=100)
 
 
 st.title("Lomdai Analysis Tool")
@@ -65,91 +93,104 @@ st.write('')
 ############################ Functions ############################
 
 
-# Sefaria API URL
-SEFARIA_API_URL = "https://www.sefaria.org/api/texts/"
-
 #@st.cache_data
-# Function to fetch text from Sefaria API
+# Function to fetch text from Sefaria API (served from the shared on-disk cache when possible)
 def fetch_text_from_sefaria(ref):
-    url = f"{SEFARIA_API_URL}{ref}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        hebrew_text_html = data.get('he', [])
-
-        # Joining the list to form a single string before cleaning HTML tags
-        hebrew_text = BeautifulSoup(' '.join(hebrew_text_html), "html.parser").get_text(separator=' ')
-
-        # Normalize the text to remove special characters
-        hebrew_text = unicodedata.normalize('NFKD', hebrew_text)
-
-        # Remove non-breaking spaces and other special characters
-        hebrew_text = hebrew_text.replace('\xa0', ' ')
-
-        # Remove non-standard whitespace characters
-        hebrew_text = re.sub(r'\s+', ' ', hebrew_text).strip()
-
-        # Remove zero-width spaces and other control characters
-        hebrew_text = re.sub(r'[\u200B-\u200D\uFEFF]', '', hebrew_text)
-
-        # Remove any remaining non-printable characters
-        hebrew_text = ''.join(c for c in hebrew_text if unicodedata.category(c)[0] != 'C')
-
+    started = time.monotonic()
+    hebrew_segments = fetch_segmented_text(ref)
+    metrics.record_fetch(ref, "ok" if hebrew_segments is not None else "failed", time.monotonic() - started)
+    if hebrew_segments is not None:
         # Save to session state
-        st.session_state['hebrew_text_raw'] = hebrew_text
+        st.session_state['hebrew_text_raw'] = str(hebrew_segments)
         return st.session_state['hebrew_text_raw']
     else:
         st.error("Failed to fetch text")
         return None
 
 
-# General function to call OpenAI API with memory
-def call_openai_api_with_memory(conversation_id, role, content, temperature):
-    if conversation_id not in st.session_state['conversation_history']:
-        st.session_state['conversation_history'][conversation_id] = [
-            {"role": "system", "content": '''#CONTEXT:
-You are helping students understand a complex philosophical work by making it more accessible to them.
-
-#ROLE:
-You are an English-speaking Jewish Orthodox rabbi.
-
-#RESPONSE GUIDELINES:
-- Avoid explicitly stating your role or the task you are performing or shalom.
-- Always reference the specific text you are working with, if known."
-- Encourage questions and discussion to engage the students with the material.
-- Avoid excessive use of jargon or technical language that may confuse the students.
-- Use bold formatting to emphasize important terms and concepts.
-- God should always be G-d.
-- Hebrew names should be used (if possible); so Moses is Moshe, Aaron is Aharon.
-- Never imply that we're evaluating the work, that would be inappropriate. It's not for us to judge, just to learn and apply.
-- The usage in English translations of Moshe or Aharon instead of Moses or Aaron is called transliteration. Transliteration is the process of transferring a word from one alphabet or writing system to another, typically by representing each letter or character with a corresponding one from the target language. In this case, "Moshe" and "Aharon" are transliterations of the Hebrew names "מֹשֶׁה" and "אַהֲרֹן", respectively, using the Latin alphabet. This is in contrast to translation, which focuses on conveying the meaning of the word, rather than just its sound or spelling. Always use transliteration for Jewish names.
-- All answers should reflect the values, traditions, and norms of the Jewish community, maintaining a focus on Jewish law (Halakha), ethics, and worldview.
-- Respect for Jewish Legal Authority: The discussions should be in line with rabbinic authority and respect the integrity of Jewish legal tradition. It should avoid framing Jewish texts or concepts in ways that contradict or diverge from established halakhic or communal standards.
-- Cultural and Religious Relevance: The discussions should ensure that its insights and discussions are meaningful and applicable to Jewish individuals, families, and communities, keeping its application grounded in the needs and values of the Jewish context.
-- Insular or Exclusive Approach: The discussions should suggest an exclusive focus on Jewish legal and ethical discourse within the Jewish community, avoiding broader external debates or viewpoints that aren't relevant to internal Jewish life.
-'''}
-        ]
-
-    st.session_state['conversation_history'][conversation_id].append({"role": role, "content": content})
-
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=st.session_state['conversation_history'][conversation_id],
-        max_tokens=1500,
-        temperature=temperature
-    )
-
-    response_message = completion.choices[0].message.content.strip()
-    st.session_state['conversation_history'][conversation_id].append({"role": "assistant", "content": response_message})
-
-    return response_message
-
-
-# Texts function to call OpenAI API with memory
-def texts_call_openai_api_with_memory(conversation_id, role, content, temperature):
-    if conversation_id not in st.session_state['conversation_history']:
-        st.session_state['conversation_history'][conversation_id] = [
-            {"role": "system", "content": '''#CONTEXT:
+# Stream responses token by token into the page instead of waiting for the whole completion
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1") != "0"
+
+# Redraw a streaming placeholder at most this often (seconds), to keep websocket traffic down
+STREAM_REDRAW_INTERVAL = 0.05
+
+# Translate the rewrite paragraph by paragraph while it is still being written, instead of after it
+PIPELINE_TRANSLATION = os.getenv("PIPELINE_TRANSLATION", "1") != "0"
+
+# Function to record the token usage of one call, including how much of the prompt the provider served from its prompt cache
+# and how many input tokens history compaction (or forking from the base context) saved
+def record_usage(label, completion, seconds, tokens_saved=0, first_token_seconds=None):
+    st.session_state['token_usage'].append({
+        'call': label,
+        'seconds': round(seconds, 2),
+        'first token (s)': round(first_token_seconds, 2) if first_token_seconds is not None else None,
+        'prompt tokens': completion.prompt_tokens,
+        'cached tokens': completion.cached_tokens,
+        'output tokens': completion.completion_tokens,
+        'tokens saved': tokens_saved,
+    })
+
+# Message shown in place of an answer while the rate limiter holds its call back
+def queue_message(position):
+    return f"Many students are asking right now, you are number {position} in line…"
+
+# Function to show a call's place in line while it waits for capacity, in the placeholder of its answer if it has one
+def queue_notice(placeholder=None):
+    notice = [placeholder]
+    def on_wait(position):
+        if notice[0] is None:
+            notice[0] = st.empty()
+        if position:
+            notice[0].caption(queue_message(position))
+        else:
+            notice[0].empty()
+    return on_wait
+
+# Function to label a call in the metrics with its section (or 'copilot') and the text it is about
+def call_tags(label):
+    return {"section": label, "ref": st.session_state.get('ref') or None}
+
+# Function to get a completion; with a placeholder, tokens are rendered into it as they arrive.
+# A call that still fails after its retries and fallback stops the run with a message instead of a traceback
+def complete(messages, temperature, placeholder=None, label='copilot', tokens_saved=0):
+    try:
+        return complete_or_raise(messages, temperature, placeholder, label, tokens_saved)
+    except Exception as e:
+        (placeholder or st).error(f"The model could not answer right now ({e}). Please try again in a moment.")
+        st.stop()
+
+def complete_or_raise(messages, temperature, placeholder=None, label='copilot', tokens_saved=0):
+    started = time.monotonic()
+    if placeholder is None or not STREAM_RESPONSES:
+        completion = llm.complete_with_usage(messages, temperature, on_wait=queue_notice(placeholder), tags=call_tags(label))
+        record_usage(label, completion, time.monotonic() - started, tokens_saved)
+        return completion.text
+
+    on_delta = stream_into(placeholder)
+    on_complete = lambda completion: record_usage(label, completion, time.monotonic() - started, tokens_saved,
+                                                  on_delta.first_token_seconds)
+    for delta in llm.stream(messages, temperature, on_complete=on_complete, on_wait=queue_notice(placeholder), tags=call_tags(label)):
+        on_delta(delta)
+    return on_delta.text.strip()
+
+# Function to render an answer into a placeholder as its pieces arrive, recording the time to its first token
+def stream_into(placeholder):
+    started = time.monotonic()
+    last_redraw = [0]
+    def on_delta(delta):
+        if not on_delta.text:
+            on_delta.first_token_seconds = time.monotonic() - started
+        on_delta.text += delta
+        if time.monotonic() - last_redraw[0] >= STREAM_REDRAW_INTERVAL:
+            placeholder.markdown(on_delta.text + " ▌")
+            last_redraw[0] = time.monotonic()
+    on_delta.text = ''
+    on_delta.first_token_seconds = None
+    return on_delta
+
+
+# System prompts of the Copilot's conversation starters (the main one, shared with batch precomputation, is in sefaria_bot.sections)
+TEXTS_SYSTEM_PROMPT = '''#CONTEXT:
 You are an expert in Jewish texts and the Talmud. Your task is to help students expand their learning and engage in more in-depth analysis of Talmudic texts.
 
 #ROLE:
@@ -167,27 +208,9 @@ As a knowledgeable guide and mentor, your role is to suggest related texts from
 2. Prioritize texts that offer new insights or challenge conventional interpretations
 3. Consider the student's level of knowledge when selecting texts
 4. Avoid suggesting texts that are too complex or require extensive background knowledge
-5. Focus on texts that will stimulate critical thinking and encourage deeper engagement with the material'''}]
-
-    st.session_state['conversation_history'][conversation_id].append({"role": role, "content": content})
+5. Focus on texts that will stimulate critical thinking and encourage deeper engagement with the material'''
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=st.session_state['conversation_history'][conversation_id],
-        max_tokens=1500,
-        temperature=temperature
-    )
-
-    response_message = completion.choices[0].message.content.strip()
-    st.session_state['conversation_history'][conversation_id].append({"role": "assistant", "content": response_message})
-
-    return response_message
-
-# Movie function to call OpenAI API with memory
-def movie_call_openai_api_with_memory(conversation_id, role, content, temperature):
-    if conversation_id not in st.session_state['conversation_history']:
-        st.session_state['conversation_history'][conversation_id] = [
-            {"role": "system", "content": '''#CONTEXT:
+MOVIE_SYSTEM_PROMPT = '''#CONTEXT:
 You are an expert in Jewish philosophy and are tasked with explaining a complex Jewish philosophical text to a student who is struggling to understand it. To make the concepts more relatable and easier to grasp, you decide to use a movie metaphor to illustrate the key ideas.
 
 #ROLE:
@@ -208,27 +231,9 @@ You will take on the role of a wise and knowledgeable teacher who is skilled at
 4. Encourage critical thinking and personal interpretation, rather than presenting a single, definitive explanation.
 
 #RESPONSE FORMAT:
-Provide the explanation in clear, concise paragraphs, using italics to highlight key terms or concepts. Use line breaks to separate different sections or ideas, and consider using bullet points to list important parallels or connections between the movie and the philosophical text.'''}]
-
-    st.session_state['conversation_history'][conversation_id].append({"role": role, "content": content})
-
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=st.session_state['conversation_history'][conversation_id],
-        max_tokens=1500,
-        temperature=temperature
-    )
+Provide the explanation in clear, concise paragraphs, using italics to highlight key terms or concepts. Use line breaks to separate different sections or ideas, and consider using bullet points to list important parallels or connections between the movie and the philosophical text.'''
 
-    response_message = completion.choices[0].message.content.strip()
-    st.session_state['conversation_history'][conversation_id].append({"role": "assistant", "content": response_message})
-
-    return response_message
-
-# Song function to call OpenAI API with memory
-def song_call_openai_api_with_memory(conversation_id, role, content, temperature):
-    if conversation_id not in st.session_state['conversation_history']:
-        st.session_state['conversation_history'][conversation_id] = [
-            {"role": "system", "content": '''#CONTEXT:
+SONG_SYSTEM_PROMPT = '''#CONTEXT:
 You are a creative songwriter tasked with creating an engaging and educational song about a complex Jewish philosophical text to help students better understand the material.
 
 #ROLE:
@@ -271,52 +276,233 @@ Bridge (optional):
 Chorus:
 [LYRICS]
 
-'''}]
+'''
 
-    st.session_state['conversation_history'][conversation_id].append({"role": role, "content": content})
+# Function to get the conversation of the session. It always starts with the same system prompt, then the
+# source text and translation, so every request of every session on a text shares one byte-identical prefix
+# that the provider's prompt cache can serve
+def conversation(conversation_id):
+    if conversation_id not in st.session_state['conversation_history']:
+        st.session_state['conversation_history'][conversation_id] = ConversationHistory(RABBI_SYSTEM_PROMPT)
+    return st.session_state['conversation_history'][conversation_id]
+
+# Function to call the LLM with the conversation memory of the session, compacted to the token budget;
+# pinned turns (the source text and its translation, added by the analysis steps) are always sent whole. Another persona's system prompt
+# goes right before the question rather than first, to keep the shared prefix intact
+def chat_with_memory(conversation_id, system_prompt, role, content, temperature, placeholder=None):
+    history = conversation(conversation_id)
+    history.append(role, content)
+
+    messages, tokens_saved = history.context()
+    if system_prompt != RABBI_SYSTEM_PROMPT:
+        messages.insert(len(messages) - 1, {"role": "system", "content": system_prompt})
+    try:
+        response_message = complete(messages, temperature, placeholder, tokens_saved=tokens_saved)
+    except BaseException:
+        # The question goes unanswered (complete() stops the run), so it leaves the conversation
+        history.pop()
+        raise
+    history.append("assistant", response_message)
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=st.session_state['conversation_history'][conversation_id],
-        max_tokens=1500,
-        temperature=temperature
-    )
+    return response_message
 
-    response_message = completion.choices[0].message.content.strip()
-    st.session_state['conversation_history'][conversation_id].append({"role": "assistant", "content": response_message})
+# General function to call OpenAI API with memory
+def call_openai_api_with_memory(conversation_id, role, content, temperature, placeholder=None):
+    return chat_with_memory(conversation_id, RABBI_SYSTEM_PROMPT, role, content, temperature, placeholder)
 
-    return response_message
+# Texts function to call OpenAI API with memory
+def texts_call_openai_api_with_memory(conversation_id, role, content, temperature, placeholder=None):
+    return chat_with_memory(conversation_id, TEXTS_SYSTEM_PROMPT, role, content, temperature, placeholder)
+
+# Movie function to call OpenAI API with memory
+def movie_call_openai_api_with_memory(conversation_id, role, content, temperature, placeholder=None):
+    return chat_with_memory(conversation_id, MOVIE_SYSTEM_PROMPT, role, content, temperature, placeholder)
+
+# Song function to call OpenAI API with memory
+def song_call_openai_api_with_memory(conversation_id, role, content, temperature, placeholder=None):
+    return chat_with_memory(conversation_id, SONG_SYSTEM_PROMPT, role, content, temperature, placeholder)
+
+# Session state key of each step's answer
+ANSWER_STATE_KEYS = {'rewrite': 'hebrew_text'}
+
+def answer_state_key(key):
+    return ANSWER_STATE_KEYS.get(key, key)
+
+# Function to get the analysis of the current text as the compute layer sees it: the source text and the answers so far
+def text_analysis():
+    answers = {key: st.session_state[answer_state_key(key)] for key in SECTIONS if st.session_state.get(answer_state_key(key))}
+    return TextAnalysis(st.session_state['ref'], st.session_state['hebrew_text_raw'], answers)
+
+# Function to count the input tokens a step saved by forking from the base context, compared to sending the whole
+# conversation as the linear chat did
+def section_tokens_saved(conversation_id, messages):
+    sent_tokens = sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages[:-1])
+    return max(0, conversation(conversation_id).total_tokens() - sent_tokens)
+
+# Function to add a section's answer to the conversation, so the Copilot can refer to it
+def remember_section(conversation_id, key, content, response_message):
+    history = conversation(conversation_id)
+    # A new rewrite starts a new text (or the same one fetched again): the base turns pinned before it are unpinned
+    if key == 'rewrite':
+        history.unpin()
+    history.append("user", content, pin=key in BASE_SECTIONS)
+    history.append("assistant", response_message, pin=key in BASE_SECTIONS)
+
+# Function to bind a computed step to the session: its answer, the conversation, and the usage tables
+def bind_step(conversation_id, result, seconds, first_token_seconds=None):
+    key = result.request.key
+    if result.completion is not None:
+        tokens_saved = section_tokens_saved(conversation_id, result.request.messages) if key not in BASE_SECTIONS else 0
+        record_usage(key, result.completion, seconds, tokens_saved, first_token_seconds)
+    remember_section(conversation_id, key, result.request.prompt, result.text)
+    st.session_state[answer_state_key(key)] = result.text
+    return result.text
+
+# Function run by a job on the worker pool: one step of the analysis, streamed into the job when a student is
+# waiting on it. It can't touch the page, the job carries its place in line and its text so far; cancelling the
+# job (another text, or the session left) stops the call
+def section_job(job, analysis, key, temperature=None, priority=PRIORITY_INTERACTIVE, values=None):
+    stream = STREAM_RESPONSES and priority == PRIORITY_INTERACTIVE
+    return run_step(analysis, key, llm, analysis_cache, metrics, temperature, job.on_delta if stream else None,
+                    priority, job.on_wait, job.cancelled, **(values or {}))
+
+# Functions run by the two jobs of a pipelined translation: the rewrite writes into the pipe as it streams,
+# the translation reads it a paragraph at a time
+def rewrite_job(job, analysis, pipe, temperature=None, priority=PRIORITY_INTERACTIVE, values=None):
+    return run_rewrite(analysis, pipe, llm, analysis_cache, metrics, temperature, job.on_delta, priority, job.on_wait,
+                       job.cancelled, **(values or {}))
+
+def translation_job(job, analysis, pipe, temperature=None, priority=PRIORITY_INTERACTIVE, values=None):
+    return run_pipelined_translation(analysis, pipe, llm, analysis_cache, metrics, temperature, job.on_delta, priority,
+                                     job.on_wait, job.cancelled)
+
+# Function to ask for one step of the analysis; it runs as a background job of the session, after the sections it
+# depends on (asked for too, and shown in their own expanders). Nothing waits here: the page polls the job
+def request_section(conversation_id, key, temperature=None, priority=PRIORITY_INTERACTIVE, **values):
+    # There is nothing to analyze before a text is fetched
+    if not st.session_state['ref'] or 'hebrew_text_raw' not in st.session_state:
+        st.session_state['section_errors'][key] = "Fetch a text first."
+        return
+    for dependency in text_analysis().missing_dependencies(key):
+        if dependency not in st.session_state['pending_sections']:
+            request_section(conversation_id, dependency, priority=priority)
+        st.session_state[dependency + '_expander_open'] = True
+
+    # Asking again (another passage to simplify, the same text fetched again) replaces the previous answer
+    st.session_state[answer_state_key(key)] = ''
+    st.session_state['section_errors'].pop(key, None)
+    st.session_state['pending_sections'][key] = {'temperature': temperature, 'priority': priority, 'values': values}
+    start_ready_sections(conversation_id)
+
+# What a step's job works on, besides the answers it builds on: asking for the same step with other values (another
+# passage to simplify) replaces its job, asking again with the same ones keeps it
+def job_inputs(request):
+    return (request['temperature'], request['values'])
+
+# Function to start the job of every requested step whose inputs have all been answered; a job already
+# running for the same request is not started twice
+def start_ready_sections(conversation_id):
+    analysis = text_analysis()
+    pending = st.session_state['pending_sections']
+    # The rewrite and its translation start together, joined by a pipe
+    if (PIPELINE_TRANSLATION and 'rewrite' in pending and 'translation' in pending and analysis.ready(['rewrite'])
+            and jobs.get(conversation_id, 'rewrite') is None and jobs.get(conversation_id, 'translation') is None):
+        pipe = ParagraphPipe()
+        jobs.submit(conversation_id, 'rewrite', job_inputs(pending['rewrite']), rewrite_job, analysis, pipe, **pending['rewrite'])
+        jobs.submit(conversation_id, 'translation', job_inputs(pending['translation']), translation_job, analysis, pipe,
+                    **pending['translation'])
+    for key, request in pending.items():
+        if analysis.ready([key]):
+            jobs.submit(conversation_id, key, job_inputs(request), section_job, analysis, key, **request)
+
+# Function to bind the answers of the session's finished jobs, and start the steps that were waiting for them
+def collect_finished_jobs(conversation_id):
+    pending = st.session_state['pending_sections']
+    errors = st.session_state['section_errors']
+    # In the order the steps run: a pipelined translation can finish before its rewrite is bound
+    for key in sorted(pending, key=list(SECTIONS).index):
+        job = jobs.get(conversation_id, key)
+        if job is None or not job.done():
+            continue
+        if any(previous in pending for previous in text_analysis().context(key)):
+            continue
+        jobs.pop(conversation_id, key)
+        pending.pop(key)
+        try:
+            result = job.result()
+        except Exception as e:
+            errors[key] = f"This section could not be generated: {e}"
+            continue
+        bind_step(conversation_id, result, job.seconds(), job.first_token_seconds)
+
+    # What waits on a step that failed can't run
+    analysis = text_analysis() if pending else None
+    for key in list(pending):
+        if jobs.get(conversation_id, key) is None and any(
+            previous not in analysis.answers and previous not in pending for previous in analysis.context(key)
+        ):
+            pending.pop(key)
+            errors[key] = "This section could not be generated because a section it builds on failed."
+    start_ready_sections(conversation_id)
+
+# Function to generate every missing section at once, behind the sections students are waiting on;
+# independent sections run in parallel, the others as soon as the sections they depend on are answered
+def analyze_everything(conversation_id):
+    for key in ANALYZE_ALL_SECTIONS:
+        st.session_state[key + '_expander_open'] = True
+        if st.session_state[key] == '' and key not in st.session_state['pending_sections']:
+            request_section(conversation_id, key, priority=PRIORITY_BACKGROUND)
+
+# How often (seconds) a step being generated is redrawn
+JOB_POLL_INTERVAL = 0.5
+
+# Function to show a step being generated: its place in line, then its text as it streams in. Only this
+# fragment reruns while the job works; once the job is finished the whole page reruns, binding its answer
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def show_job(key):
+    if key not in st.session_state['pending_sections']:
+        return
+    job = jobs.get(st.session_state['conversation_id'], key)
+    if job is None:
+        st.caption("Waiting for the sections it builds on…")
+    elif job.done():
+        st.rerun()
+    elif job.position:
+        st.caption(queue_message(job.position))
+    elif job.text and key == 'rewrite':
+        st.write(f"<div style='font-family: Noto Sans Hebrew;'>{job.text} ▌</div>", unsafe_allow_html=True)
+    elif job.text:
+        st.markdown(job.text + " ▌")
+    else:
+        st.caption("Generating…")
+        if key == 'rewrite':
+            # The text as fetched, until its rewrite starts coming in
+            st.write(f"<div style='font-family: Noto Sans Hebrew;'>{st.session_state['hebrew_text_raw']}</div>", unsafe_allow_html=True)
+
+# Function to show, where a section's answer will appear, that it is being generated or why it could not be
+def section_status(key):
+    if key in st.session_state['section_errors']:
+        st.error(st.session_state['section_errors'][key])
+    elif key in st.session_state['pending_sections']:
+        show_job(key)
 
-#@st.cache_data
 #Function to re-write hebrew text
 def rewrite_hebrew_text(conversation_id, text, ref, temperature=1):
-    content = f'''This text is {ref}. Re-write the following text in hebrew, avoiding repetition. Here is the text: \n{text}. Please, skip lines when appropriate.  Do not use bold or italic font, do not say what you have done, do not say anaything else. Respond with only the re-written text. '''
-    st.session_state['hebrew_text'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['hebrew_text']
-
-@st.cache_data
-# Function to translate text using GPT
-def translate_native_text(conversation_id, text, temperature=0.5):
-    content = f''' Translate the following text to english, always using transliteration for Jewish names:\n{text}\n. Answer only with the translated text. Do not say anything else, do not say what you have done.'''
-    st.session_state['translation'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['translation']
-
-@st.cache_data
+    request_section(conversation_id, 'rewrite', temperature, ref=ref, text=text)
+
+# Function to translate text using GPT (the rewrite, once it is answered)
+def translate_native_text(conversation_id, temperature=0.5):
+    request_section(conversation_id, 'translation', temperature)
+
+# Function to re-write and translate the text; the translation is asked for first so that, with PIPELINE_TRANSLATION,
+# both are waiting when the rewrite starts and its translation follows it paragraph by paragraph
+def rewrite_and_translate(conversation_id, text, ref):
+    translate_native_text(conversation_id)
+    rewrite_hebrew_text(conversation_id, text, ref, temperature=1)
+
 # Summary
 def summary_text(conversation_id, ref, temperature=1):
-    content = f'''#CONTEXT:
-This Section is called 'Summary'.
-This is the first section in a Jewish Texts analysis app.
-The task is to analyze a given text and provide a brief overview focusing on the central philosophical question or problem addressed in the text: {ref}. Always provide new and original information, never repeat what you have said in previous sections. Answer only with the summary, do not say anything else, do not say what you have done.'
-
-#Task:
-1. Identify the central philosophical question or problem addressed in the text'
-2. Provide a brief overview of the text in one paragraph.
-3. Use emojis throughout the overview to make it more engaging and fun.
-4. Avoid using emojis in any further interactions beyond the overview.
-5. Answer only with the overview, without adding any additional information or explanations.'''
-    st.session_state['summary'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['summary']
+    request_section(conversation_id, 'summary', temperature, ref=ref)
 
 # @st.cache_data
 # # Summary
@@ -325,148 +511,37 @@ The task is to analyze a given text and provide a brief overview focusing on the
 #     st.session_state['summary'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
 #     return st.session_state['summary']
 
-@st.cache_data
 # Backround Information
 def background_text(conversation_id, ref, temperature=1):
-    content = f'''#CONTEXT:
-This Section is called 'Backgound Information'.
-This is the second section in a Jewish Texts analysis app.
-The task is to provide backgound information on the text: {ref}'. Always provide new and original information, never repeat what you have said in previous sections. Answer only with the backgound information, do not say anything else, do not say what you have done.
-
-#Task:
-1. Book Overview: A brief summary of the book’s plot, themes, and purpose to give insight into how the chapter fits within the broader narrative or argument.
-2. Chapter Placement: How the chapter fits into the structure of the book—whether it introduces key ideas, builds on previous chapters, or concludes a part of the story or argument.
-3. Character or Theme Development: If relevant, how the chapter advances the development of characters, themes, or ideas within the book.
-4. Author’s Intentions: Information on the author’s motivations or intended messages in that specific chapter.
-5. Relevance to Overall Themes: Explanation of how the chapter supports or contrasts with the central themes or messages of the book.
-6. Literary Devices or Style: Notable techniques or styles used by the author in that chapter (e.g., symbolism, foreshadowing, tone) '''
-    st.session_state['background'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['background']
-
-@st.cache_data
+    request_section(conversation_id, 'background', temperature, ref=ref)
+
 # Breakdown of Key Sections
 def breakdown_text(conversation_id, ref, temperature=1):
-    content = f'''#CONTEXT:
-This Section is called 'Breakdown of Key Sections'.
-This is the third section in a Jewish Texts analysis app.
-The task is to identify key sections of {ref}. Always provide new and original information, never repeat what you have said in previous sections. Answer only with the breakdown of key sections, do not say anything else, do not say what you have done.
-
-#Task:
-1. Main Idea: Summarize the main idea in 1-2 sentences.
-2. Important Terminology or Concepts: Identify and define any crucial terminology or concepts introduced.
-3. Relation to Overall Argument: Explain how this section or argument contributes to the overall thesis of the text.'''
-    st.session_state['breakdown'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['breakdown']
-
-@st.cache_data
+    request_section(conversation_id, 'breakdown', temperature, ref=ref)
+
 # Simplifying Challenging Passages
 def simplify_text(conversation_id, ref, passage, temperature=1):
-    content = f'''#CONTEXT:
-This Section is called 'Simplification of Challenging Passages'.
-This is the fourth section in a Jewish Texts analysis app.
-The user finds this passage difficult: \n'{passage}'\n in the text \n'{ref}'\n The task is to simplify a challenging passage provided by the user. Always provide new and original information, never repeat what you have said in previous sections. Answer only with the simplification of challenging passages, do not say anything else, do not say what you have done.
-
-Task:
-1. Locate the appropriate passage in the text
-2. Provide simplified explanations of this passage to aid understanding.'''
-    st.session_state['simplify'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['simplify']
-
-@st.cache_data
+    request_section(conversation_id, 'simplify', temperature, ref=ref, passage=passage)
+
 # Identify Core Arguments
 def identify_text(conversation_id, ref, temperature=1):
-    content = f'''#CONTEXT:
-This Section is called 'Identification of Core Arguments'.
-This is the fifth section in a Jewish Texts analysis app.
-The task is to identifying and summarizing the core arguments presented in the text {ref}. Always provide new and original information, never repeat what you have said in previous sections. Answer only with the identification of core arguments, do not say anything else, do not say what you have done.
-
-    #TASK:
-1. Focus on identifying and summarizing the core arguments presented in the text
-2. Provide clear explanations of the reasoning behind each argument
-3. Discuss the significance and implications of the arguments in the context of Jewish philosophy
-4. Avoid going into excessive detail or tangents unrelated to the core arguments
-5. Use clear and concise language that is accessible to readers with varying levels of familiarity with Jewish philosophy
-'''
-    st.session_state['identify'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['identify']
+    request_section(conversation_id, 'identify', temperature, ref=ref)
 
-@st.cache_data
 # Logical Connections and Flow
 def flow_text(conversation_id, ref, temperature=0.5):
-    content = f"This Section is called 'Logical Connections Between Core Arguments'. Trace and elucidate the logical flow that binds the arguments presented in the text {ref}, noting how each premise builds upon the other and the logical operations employed (e.g., deduction, induction). Do not say what you have done. Do not repeat what you have said before."
-    st.session_state['flow'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['flow']
+    request_section(conversation_id, 'flow', temperature, ref=ref)
 
-@st.cache_data
 # Challenges of Core Arguments
 def criticize_text(conversation_id, ref, temperature=0.5):
-    content = f'''This Section is called 'Challenges of Core Arguments'
-    #Evaluate Strengths
-   - Discuss the strengths of each core argument presented in the text {ref}
-   - Consider the logic, evidence, and reasoning used to support the arguments
-
-#Assess Weaknesses
-   - Identify any weaknesses or flaws in the core arguments
-   - Analyze potential counterarguments or alternative perspectives
-
-#Implications and Significance
-   - Discuss the implications of the core arguments within the context of Jewish philosophy
-   - Consider the potential impact or significance of the arguments on the field
-
-#JEWISH PHILOSOPHICAL TEXT CRITERIA
-    - Focus on the central arguments and claims made by the author
-    - Consider the text within the broader context of Jewish philosophical thought
-    - Avoid personal opinions or biases; maintain a scholarly and objective tone internal to the jewish community
-    - Use clear and concise language to convey your critical analysis
-    - Use bullet points or numbered lists to present key points within each section
-    - Use proper formatting for any quotes or references to the original text
-    - Maintain a professional and scholarly tone throughout the analysis
-'''
-    st.session_state['criticism'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['criticism']
+    request_section(conversation_id, 'criticism', temperature, ref=ref)
 
-@st.cache_data
 # Provide Alternative Viewpoints
-def counter_text(conversation_id, ref,  temperature=0.5):
-    content = f'''This Section is called 'Alternate Viewpoints'
-    - Provide at least three alternative viewpoints on the text {ref}, each representing a different school of thought or interpretation method within Jewish philosophy.
-- For each viewpoint, explain the key arguments, assumptions, and conclusions drawn from the text.
-- Analyze the strengths and weaknesses of each viewpoint, considering factors such as logical consistency, textual evidence, and compatibility with other Jewish teachings.
-- Conclude by synthesizing the insights gained from the different viewpoints and offering a balanced, nuanced understanding of the text's meaning and significance.
-- Focus on the text's central themes, arguments, and concepts, rather than minor details or tangential issues.
- Consider the text's place within the broader context of Jewish thought and its relationship to other Jewish philosophical works.
-- Avoid imposing modern or non-Jewish philosophical frameworks onto the text; instead, strive to understand it on its own terms and within its historical and cultural context.
-- Engage with the text critically and analytically, but also with respect and sensitivity to its religious and cultural significance.'''
-    st.session_state['counter'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['counter']
-
-@st.cache_data
+def counter_text(conversation_id, ref, temperature=0.5):
+    request_section(conversation_id, 'counter', temperature, ref=ref)
+
 # Impact on Philosophical Thought
 def impact_text(conversation_id, ref, temperature=0.5):
-    content = f'''This Section is called 'Impact of the Text on Philosophical Thought'
-    #RESPONSE GUIDELINES:
-- Explain this in a way to make it fun and intriguing to discuss at a Shabbat dinner
-- Analyze how the text {ref} builds upon, challenges, or diverges from existing philosophical traditions
-- Discuss the novel contributions the text makes to Jewish philosophical thought
-- Examine the broader philosophical implications and significance of the text's ideas
-- Evaluate the text's lasting impact and influence on subsequent philosophical works and thinkers
-- Offer a critical assessment of the text's strengths, limitations, and potential areas for further exploration
-
-#TASK CRITERIA:
-1. Focus on the philosophical content and arguments rather than biographical details of the author
-2. Situate the text within the broader context of Jewish philosophical traditions and debates
-3. Highlight the text's original insights and contributions to philosophical discourse
-4. Use specific examples and passages from the text to support your analysis
-5. Avoid excessive jargon and strive for clarity in explaining complex philosophical concepts
-6. Maintain an objective and balanced perspective, acknowledging both the text's merits and potential criticisms
-
-#RESPONSE FORMAT:
-- Use clear headings and subheadings to organize your analysis
-- Provide a brief introduction outlining the text's main themes and arguments
-- Dedicate separate sections to discussing the text's philosophical contributions, implications, and impact
-- Conclude several ways to use this text to inspire a Shabbat table converstaion'''
-    st.session_state['impact'] = call_openai_api_with_memory(conversation_id, "user", content, temperature)
-    return st.session_state['impact']
+    request_section(conversation_id, 'impact', temperature, ref=ref)
 
 
 
@@ -549,7 +624,7 @@ user_question = st.sidebar.text_input("Please ask a question related to the text
 
 # Handle the main chat interaction when Enter is pressed
 if user_question != st.session_state['prv_user_question']: #and st.session_state['show_starters'] is False:
-    chatbot_response = call_openai_api_with_memory(st.session_state['conversation_id'], 'user', user_question, 0.5)
+    chatbot_response = call_openai_api_with_memory(st.session_state['conversation_id'], 'user', user_question, 0.5, st.sidebar.empty())
     st.session_state['chat_history'].append((f"**User:** {user_question}", f"**Chatbot:** {chatbot_response}"))
     st.session_state['show_starters'] = False  # Hide starters after first interaction
     st.session_state['prv_user_question'] = user_question
@@ -564,21 +639,21 @@ if st.session_state['show_starters']:
 
     with col1:
         if st.button("Suggest a related text"):
-            chatbot_response = texts_call_openai_api_with_memory(st.session_state['conversation_id'], 'user', "Suggest a related text to {st.session_state['ref_user']} to study", 0.5)
+            chatbot_response = texts_call_openai_api_with_memory(st.session_state['conversation_id'], 'user', "Suggest a related text to {st.session_state['ref_user']} to study", 0.5, st.sidebar.empty())
             st.session_state['chat_history'].append((f"**User:** Suggest a related text to {st.session_state['ref_user']} to study", f"**Chatbot:** {chatbot_response}"))
             st.session_state['show_starters'] = False
             st.rerun()
 
     with col2:
         if st.button("Turn the text into a movie"):
-            chatbot_response = movie_call_openai_api_with_memory(st.session_state['conversation_id'], 'user', 'First ask the user what is his favorite movie. Then turn the text into this movie', 1)
+            chatbot_response = movie_call_openai_api_with_memory(st.session_state['conversation_id'], 'user', 'First ask the user what is his favorite movie. Then turn the text into this movie', 1, st.sidebar.empty())
             st.session_state['chat_history'].append((f"**User:** Turn the text into a movie", f"**Chatbot:** {chatbot_response}"))
             st.session_state['show_starters'] = False
             st.rerun()
 
     with col3:
         if st.button("Turn the text into a song"):
-            chatbot_response = song_call_openai_api_with_memory(st.session_state['conversation_id'], 'user', 'Trun the text into a song', 1)
+            chatbot_response = song_call_openai_api_with_memory(st.session_state['conversation_id'], 'user', 'Trun the text into a song', 1, st.sidebar.empty())
             st.session_state['chat_history'].append((f"**User:** Trun the text into a song", f"**Chatbot:** {chatbot_response}"))
             st.session_state['show_starters'] = False
             st.rerun()
@@ -588,6 +663,11 @@ for question, response in reversed(st.session_state['chat_history']):
     st.sidebar.write(question)
     st.sidebar.write(response)
 
+# Token usage of the session's calls; cached tokens were served from the provider's prompt cache
+with st.sidebar.expander("Token usage"):
+    if st.session_state['token_usage']:
+        st.table(st.session_state['token_usage'])
+
 
 
 
@@ -611,6 +691,10 @@ if 'translation' not in st.session_state:
     st.session_state['ref'] = ''
     st.session_state['ref_user'] = ''
 
+# Answers that came in since the last run are bound to the session before the page is drawn
+if st.session_state['pending_sections']:
+    collect_finished_jobs(st.session_state['conversation_id'])
+
 # Create two columns
 col1, col2, col3, col4, col5, col6 = st.columns(6)
 
@@ -618,31 +702,30 @@ col1, col2, col3, col4, col5, col6 = st.columns(6)
 with col1:
     book = st.selectbox(
     "Book",
-    ("Shev Shmayasa", "Tikkunei Zohar", "Genesis"),)
+    tuple(BOOKS),)
 
 with col2:
     chapter = st.text_input("Chapter number")
 
 
-if book == 'Tikkunei Zohar' and 'a' not in chapter and 'b' not in chapter and 'c' not in chapter:
-    ref = 'Tikkunei_Zohar, '+chapter+'a'
-    ref_user = 'Tikkunei Zohar, '+chapter+'a'
-else:
-    ref = 'Tikkunei_Zohar, '+chapter
-    ref_user = 'Tikkunei Zohar, '+chapter
-
-if book == 'Shev Shmayasa':
-    ref = 'Shev_Shmateta, '+'Shmatta '+chapter
-    ref_user = 'Shev Shmayasa, '+chapter
-
-if book == 'Genesis':
-    ref = 'Genesis, '+chapter
-    ref_user = 'Genesis, '+chapter
+# The ref used for fetching and caching and the one shown to the user come from the same parse
+try:
+    parsed_ref = book_ref(book, chapter)
+    ref = parsed_ref.canonical
+    ref_user = parsed_ref.display
+    ref_error = None
+except InvalidRef as e:
+    ref = ''
+    ref_user = ''
+    ref_error = str(e)
 
 #with col1:
 if st.button("Fetch and Translate"):
         #st.write(ref)  # Debugging: Check if the button press is registered
-        if ref != st.session_state['ref']:
+        if ref_error is not None:
+            # Invalid chapters are rejected before any call to Sefaria
+            st.error(ref_error)
+        elif ref != st.session_state['ref']:
             st.session_state['summary_expander_open'] = False
             st.session_state['summary'] = ''
             st.session_state['background_expander_open'] = False
@@ -661,14 +744,17 @@ if st.button("Fetch and Translate"):
             st.session_state['counter'] = ''
             st.session_state['impact_expander_open'] = False
             st.session_state['impact'] = ''
+            # Answers still in flight belong to the previous text: their calls are cancelled
+            st.session_state['pending_sections'] = {}
+            st.session_state['section_errors'] = {}
+            jobs.discard(st.session_state['conversation_id'])
             st.session_state['show_starters'] = True
 
-        if ref:
-            fetch_text_from_sefaria(ref)
-            rewrite_hebrew_text(st.session_state['conversation_id'], st.session_state['hebrew_text_raw'], ref_user, temperature=1)
-            translate_native_text(st.session_state['conversation_id'], st.session_state['hebrew_text'])
+        # A text that could not be fetched is not analyzed; the error stays on the page
+        if ref and fetch_text_from_sefaria(ref) is not None:
             st.session_state['ref']  = ref
             st.session_state['ref_user']  = ref_user
+            rewrite_and_translate(st.session_state['conversation_id'], st.session_state['hebrew_text_raw'], ref_user)
             #st.session_state['Text'] = 'Text'
             #st.session_state['Translation'] = 'Translation'
             st.rerun()
@@ -679,16 +765,25 @@ col1, col2 = st.columns(2)
 
 # Add content to the first column
 with col1:
-    if st.session_state['translation']  != '':
+    if st.session_state.get('hebrew_text') or 'rewrite' in st.session_state['pending_sections']:
         st.subheader('Text 📜')
+    if st.session_state.get('hebrew_text'):
         st.write(f"<div style='font-family: Noto Sans Hebrew;'>{st.session_state['hebrew_text']}</div>", unsafe_allow_html=True)
+    section_status('rewrite')
 
 
 # Add content to the second column
 with col2:
-    if st.session_state['translation']  != '':
+    if st.session_state['translation'] != '' or 'translation' in st.session_state['pending_sections']:
         st.subheader('Translation 🌐')
+    if st.session_state['translation'] != '':
         st.write(st.session_state['translation'])
+    section_status('translation')
+
+# Generate every section at once instead of one button at a time
+if st.session_state['translation'] != '':
+    if st.button("Analyze everything"):
+        analyze_everything(st.session_state['conversation_id'])
 
 
 
@@ -704,7 +799,7 @@ if 'summary' not in st.session_state:
 
 with st.expander("Summary", expanded=st.session_state['summary_expander_open']):
     #st.write(st.session_state['summary_expander_open'])
-    if st.session_state['summary'] == '':
+    if st.session_state['summary'] == '' and 'summary' not in st.session_state['pending_sections']:
         st.write('')
         if st.button("Summarize"):
             st.session_state['summary_expander_open'] = True
@@ -715,6 +810,7 @@ with st.expander("Summary", expanded=st.session_state['summary_expander_open']):
     with col2sum:
         st.write('')
         st.write(st.session_state['summary'])
+        section_status('summary')
 
 
 
@@ -727,7 +823,7 @@ if 'background' not in st.session_state:
     st.session_state['background_expander_open'] = False
 
 with st.expander("Background Information", expanded=st.session_state['background_expander_open']):
-    if st.session_state['background'] == '':
+    if st.session_state['background'] == '' and 'background' not in st.session_state['pending_sections']:
         st.write('')
         if st.button("Get Backgound Information"):
             st.session_state['background_expander_open'] = True
@@ -737,6 +833,7 @@ with st.expander("Background Information", expanded=st.session_state['background
     with col2back:
         st.write('')
         st.write(st.session_state['background'])
+        section_status('background')
     #st.write('background')
 
 
@@ -755,7 +852,7 @@ if 'breakdown' not in st.session_state:
     st.session_state['breakdown_expander_open'] = False
 
 with st.expander("Breakdown of Key Sections", expanded=st.session_state['breakdown_expander_open']):
-    if st.session_state['breakdown'] == '':
+    if st.session_state['breakdown'] == '' and 'breakdown' not in st.session_state['pending_sections']:
         st.write('')
         if st.button("Breakdown Key Sections"):
             st.session_state['breakdown_expander_open'] = True
@@ -765,6 +862,7 @@ with st.expander("Breakdown of Key Sections", expanded=st.session_state['breakdo
     with col2break:
         st.write('')
         st.write(st.session_state['breakdown'])
+        section_status('breakdown')
     #st.write('background')
 
 
@@ -790,6 +888,7 @@ with st.expander("Simplification of Challenging Passages", expanded=st.session_s
     with col2simp:
         st.write('')
         st.write(st.session_state['simplify'])
+        section_status('simplify')
 
 
 
@@ -802,7 +901,7 @@ if 'identify' not in st.session_state:
     st.session_state['identify_expander_open'] = False
 
 with st.expander("Identification and Summary of Core Arguments", expanded=st.session_state['identify_expander_open']):
-    if st.session_state['identify'] == '':
+    if st.session_state['identify'] == '' and 'identify' not in st.session_state['pending_sections']:
         st.write('')
         if st.button("Get Core Arguments"):
             st.session_state['identify_expander_open'] = True
@@ -812,6 +911,7 @@ with st.expander("Identification and Summary of Core Arguments", expanded=st.ses
     with col2ident:
         st.write('')
         st.write(st.session_state['identify'])
+        section_status('identify')
 
 
 #######
@@ -823,7 +923,7 @@ if 'flow' not in st.session_state:
     st.session_state['flow_expander_open'] = False
 
 with st.expander("Logical Connections Between Core Arguments ", expanded=st.session_state['flow_expander_open']):
-    if st.session_state['flow'] == '':
+    if st.session_state['flow'] == '' and 'flow' not in st.session_state['pending_sections']:
         st.write('')
         if st.button("Draw Logical Connections"):
             st.session_state['flow_expander_open'] = True
@@ -833,6 +933,7 @@ with st.expander("Logical Connections Between Core Arguments ", expanded=st.sess
     with col2flow:
         st.write('')
         st.write(st.session_state['flow'])
+        section_status('flow')
 
 
 
@@ -845,7 +946,7 @@ if 'criticism' not in st.session_state:
     st.session_state['criticism_expander_open'] = False
 
 with st.expander("Challenges of Core Arguments", expanded=st.session_state['criticism_expander_open']):
-    if st.session_state['criticism'] == '':
+    if st.session_state['criticism'] == '' and 'criticism' not in st.session_state['pending_sections']:
         st.write('')
         if st.button("Criticize Core Arguments"):
             st.session_state['criticism_expander_open'] = True
@@ -855,6 +956,7 @@ with st.expander("Challenges of Core Arguments", expanded=st.session_state['crit
     with col2crit:
         st.write('')
         st.write(st.session_state['criticism'])
+        section_status('criticism')
 
 
 #######
@@ -866,7 +968,7 @@ if 'counter' not in st.session_state:
     st.session_state['counter_expander_open'] = False
 
 with st.expander("Alternative Viewpoints", expanded=st.session_state['counter_expander_open']):
-    if st.session_state['counter'] == '':
+    if st.session_state['counter'] == '' and 'counter' not in st.session_state['pending_sections']:
         st.write('')
         if st.button("Provide Alternative Viewpoints"):
             st.session_state['counter_expander_open'] = True
@@ -876,6 +978,7 @@ with st.expander("Alternative Viewpoints", expanded=st.session_state['counter_ex
     with col2counter:
         st.write('')
         st.write(st.session_state['counter'])
+        section_status('counter')
 
 #######
 
@@ -886,7 +989,7 @@ if 'impact' not in st.session_state:
     st.session_state['impact_expander_open'] = False
 
 with st.expander("Impact of the Text on Philosophical Thought", expanded=st.session_state['impact_expander_open']):
-    if st.session_state['impact'] == '':
+    if st.session_state['impact'] == '' and 'impact' not in st.session_state['pending_sections']:
         st.write('')
         if st.button("Get Impact"):
             st.session_state['impact_expander_open'] = True
@@ -896,6 +999,7 @@ with st.expander("Impact of the Text on Philosophical Thought", expanded=st.sess
     with col2impact:
         st.write('')
         st.write(st.session_state['impact'])
+        section_status('impact')
 
 
 ############################ CSS ############################
@@ -0,0 +1 @@
+# Shared building blocks for the Sefaria Bot Streamlit apps
@@ -0,0 +1,266 @@
+import os
+import threading
+from collections import namedtuple
+
+from sefaria_bot.analysis_cache import section_key
+from sefaria_bot.llm import CANCEL_CHECK_INTERVAL, PRIORITY_INTERACTIVE, Cancelled, Completion
+from sefaria_bot.refs import parse_ref
+from sefaria_bot.sections import BASE_SECTIONS, RABBI_SYSTEM_PROMPT, SECTIONS, all_dependencies, render_section
+
+
+# Shortest piece of the rewrite (characters) sent for translation on its own; shorter lines wait for the next ones
+PIPELINE_MIN_CHARS = int(os.getenv("PIPELINE_MIN_CHARS", "200"))
+
+
+# One analysis step ready to send: its prompt, the messages that carry it, its temperature and its key in the analysis cache
+StepRequest = namedtuple("StepRequest", ["key", "prompt", "messages", "temperature", "cache_key"])
+
+# The answer to one step; completion (with token usage) is None when the answer came from the analysis cache
+StepResult = namedtuple("StepResult", ["request", "text", "completion"])
+
+
+# The analysis of one text, independent of any session: its source text and the answers of the steps done so far.
+# The app, the background jobs and batch precomputation all build their requests from it, so they share cache keys.
+class TextAnalysis:
+
+    def __init__(self, ref, source_text, answers=None):
+        parsed = parse_ref(ref)
+        self.ref = parsed.canonical
+        self.ref_user = parsed.display
+        self.source_text = source_text
+        self.answers = dict(answers or {})
+
+    # The prompt of one step; values (e.g. the passage to simplify) are filled into the template
+    def prompt(self, key, **values):
+        defaults = {"ref": self.ref_user}
+        if key == 'rewrite':
+            defaults["text"] = self.source_text
+        elif key == 'translation':
+            defaults["text"] = self.answers['rewrite']
+        defaults.update(values)
+        return render_section(key, **defaults)
+
+    # The steps whose exchanges come before a step: the translation follows the rewrite, the sections fork from
+    # both and see the sections they depend on
+    def context(self, key):
+        if key == 'rewrite':
+            return []
+        if key == 'translation':
+            return ['rewrite']
+        return ['rewrite', 'translation'] + all_dependencies(key)
+
+    # The sections a step needs that aren't answered yet, in the order to run them
+    def missing_dependencies(self, key):
+        return [dependency for dependency in all_dependencies(key) if dependency not in self.answers]
+
+    # Steps not answered yet whose inputs are all there
+    def ready(self, keys):
+        return [key for key in keys if key not in self.answers and all(previous in self.answers for previous in self.context(key))]
+
+    def request(self, key, model, temperature=None, **values):
+        if temperature is None:
+            temperature = SECTIONS[key].temperature
+        messages = [{"role": "system", "content": RABBI_SYSTEM_PROMPT}]
+        for previous in self.context(key):
+            messages.append({"role": "user", "content": self.prompt(previous)})
+            messages.append({"role": "assistant", "content": self.answers[previous]})
+        content = self.prompt(key, **values)
+        messages.append({"role": "user", "content": content})
+
+        # The translation's source text is the rewrite it translates; a section's key covers every answer the model
+        # sees before it, the rewrite and translation it forks from as well as the sections it depends on
+        source_text = self.answers['rewrite'] if key == 'translation' else self.source_text
+        dependency_answers = [self.answers[previous] for previous in self.context(key)] if key not in BASE_SECTIONS else []
+        cache_key = section_key(self.ref, key, model, temperature, source_text, content, dependency_answers)
+        return StepRequest(key, content, messages, temperature, cache_key)
+
+
+# Run one step of an analysis: from the shared cache when any session (or batch precomputation) already ran it,
+# otherwise through the gateway, streaming the answer piece by piece to on_delta if given. It touches no session
+# state and doesn't change the analysis, so it can run on any thread; the caller records the answer.
+# Setting the cancel event stops the call with Cancelled, and nothing is cached.
+def run_step(analysis, key, gateway, cache, metrics=None, temperature=None, on_delta=None,
+             priority=PRIORITY_INTERACTIVE, on_wait=None, cancel=None, **values):
+    request = analysis.request(key, gateway.policy.model, temperature, **values)
+    text = cache.get(request.cache_key)
+    if text is not None:
+        if metrics is not None:
+            metrics.record_cache_hit(key, analysis.ref)
+        return StepResult(request, text, None)
+
+    tags = {"section": key, "ref": analysis.ref}
+    if on_delta is None:
+        completion = gateway.complete_with_usage(request.messages, request.temperature, priority=priority, on_wait=on_wait, tags=tags,
+                                                 cancel=cancel)
+    else:
+        completions = []
+        pieces = gateway.stream(request.messages, request.temperature, on_complete=completions.append,
+                                priority=priority, on_wait=on_wait, tags=tags, cancel=cancel)
+        try:
+            for piece in pieces:
+                on_delta(piece)
+        finally:
+            pieces.close()
+        completion = completions[-1]
+    cache.put(request.cache_key, analysis.ref, key, completion.text)
+    return StepResult(request, completion.text, completion)
+
+
+# The rewrite as it is being written, handed over to its translation a paragraph at a time: a paragraph is closed
+# at a line break once it is PIPELINE_MIN_CHARS long, and the last one when the rewrite is finished
+class ParagraphPipe:
+
+    def __init__(self, min_chars=PIPELINE_MIN_CHARS):
+        self.min_chars = min_chars
+        self.text = None
+        self._buffer = ''
+        self._paragraphs = []
+        self._finished = False
+        self._error = None
+        self._condition = threading.Condition()
+
+    def _close_paragraph(self, paragraph):
+        if paragraph.strip():
+            self._paragraphs.append(paragraph.strip())
+
+    def write(self, piece):
+        with self._condition:
+            self._buffer += piece
+            cut = self._buffer.rfind('\n')
+            if cut >= self.min_chars:
+                self._close_paragraph(self._buffer[:cut])
+                self._buffer = self._buffer[cut + 1:]
+                self._condition.notify_all()
+
+    # The rewrite is done: text is the whole answer, rest what of it wasn't written piece by piece (all of it
+    # when it came from the cache), so a reader that hasn't started yet sees it whole
+    def finish(self, text, rest=''):
+        with self._condition:
+            self.text = text
+            self._close_paragraph(self._buffer + rest)
+            self._buffer = ''
+            self._finished = True
+            self._condition.notify_all()
+
+    def fail(self, error):
+        with self._condition:
+            self._error = error
+            self._finished = True
+            self._condition.notify_all()
+
+    # Yields each closed paragraph as soon as it is, and None whenever nothing new came for a while;
+    # ends when the rewrite is finished, raising its error if it failed
+    def paragraphs(self, cancel=None):
+        handed = 0
+        while True:
+            with self._condition:
+                if handed == len(self._paragraphs) and not self._finished:
+                    self._condition.wait(CANCEL_CHECK_INTERVAL)
+                new = self._paragraphs[handed:]
+                finished = self._finished
+                error = self._error
+            if cancel is not None and cancel.is_set():
+                raise Cancelled("The call was cancelled")
+            if error is not None:
+                raise error
+            for paragraph in new:
+                yield paragraph
+            handed += len(new)
+            if finished and handed == len(self._paragraphs):
+                return
+            if not new:
+                yield None
+
+    def finished(self):
+        with self._condition:
+            return self._finished
+
+
+# Run the rewrite, always streamed, writing it into the pipe as it comes so its translation can start right away
+def run_rewrite(analysis, pipe, gateway, cache, metrics=None, temperature=None, on_delta=None,
+                priority=PRIORITY_INTERACTIVE, on_wait=None, cancel=None, **values):
+    streamed = []
+    def write(piece):
+        streamed.append(piece)
+        pipe.write(piece)
+        if on_delta is not None:
+            on_delta(piece)
+    try:
+        result = run_step(analysis, 'rewrite', gateway, cache, metrics, temperature, write, priority, on_wait, cancel, **values)
+    except BaseException as error:
+        pipe.fail(error)
+        raise
+    pipe.finish(result.text, '' if streamed else result.text)
+    return result
+
+
+# Translate the rewrite paragraph by paragraph while run_rewrite is still writing it: each paragraph is sent as soon
+# as it closes, the paragraphs are translated in parallel, and the translation is streamed to on_delta in order.
+# The joined translation is cached under a key of its own, since it isn't the one-call translation's answer; when the
+# rewrite came whole (from the cache) a cached translation of either kind is used instead of translating anything.
+def run_pipelined_translation(analysis, pipe, gateway, cache, metrics=None, temperature=None, on_delta=None,
+                              priority=PRIORITY_INTERACTIVE, on_wait=None, cancel=None):
+    if temperature is None:
+        temperature = SECTIONS['translation'].temperature
+    tags = {"section": "translation", "ref": analysis.ref}
+    futures = []
+    texts = []
+
+    # The one-call translation of the whole rewrite, and the same request under the pipelined translation's cache key
+    def whole_request():
+        translated = TextAnalysis(analysis.ref, analysis.source_text, dict(analysis.answers, rewrite=pipe.text))
+        return translated.request('translation', gateway.policy.model, temperature)
+
+    def pipelined_request(whole):
+        return whole._replace(cache_key=section_key(analysis.ref, 'translation', gateway.policy.model, whole.temperature,
+                                                    pipe.text, whole.prompt, mode='pipelined'))
+
+    # Hand the translations that are done, in order, to on_delta
+    def emit(block=False):
+        while len(texts) < len(futures) and (block or futures[len(texts)].done()):
+            text = futures[len(texts)].result().text
+            if on_delta is not None:
+                on_delta(('\n\n' if texts else '') + text)
+            texts.append(text)
+
+    try:
+        for paragraph in pipe.paragraphs(cancel):
+            if paragraph is None:
+                emit()
+                continue
+            if not futures and pipe.finished():
+                whole = whole_request()
+                request = pipelined_request(whole)
+                text = cache.get(request.cache_key)
+                if text is None:
+                    request = whole
+                    text = cache.get(request.cache_key)
+                if text is not None:
+                    if metrics is not None:
+                        metrics.record_cache_hit('translation', analysis.ref)
+                    if on_delta is not None:
+                        on_delta(text)
+                    return StepResult(request, text, None)
+            messages = [
+                {"role": "system", "content": RABBI_SYSTEM_PROMPT},
+                {"role": "user", "content": render_section('translation', ref=analysis.ref_user, text=paragraph)},
+            ]
+            futures.append(gateway.submit(messages, temperature, priority=priority, on_wait=on_wait, tags=tags, cancel=cancel))
+            emit()
+        emit(block=True)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+    completions = [future.result() for future in futures]
+    text = '\n\n'.join(texts)
+    completion = Completion(
+        text, completions[-1].model if completions else gateway.policy.model,
+        sum(completion.prompt_tokens for completion in completions),
+        sum(completion.cached_tokens for completion in completions),
+        sum(completion.completion_tokens for completion in completions),
+    )
+    request = pipelined_request(whole_request())
+    cache.put(request.cache_key, analysis.ref, 'translation', text)
+    return StepResult(request, text, completion)
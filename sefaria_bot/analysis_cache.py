@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from sefaria_bot.cache import CACHE_PATH
+from sefaria_bot.resources import resource
+from sefaria_bot.sections import SECTIONS
+
+
+# LLM answers are kept next to the Sefaria texts by default, in their own table
+ANALYSIS_CACHE_PATH = os.getenv("SEFARIA_ANALYSIS_CACHE_PATH", CACHE_PATH)
+
+# Upper bound on the stored answers (bytes of text); least recently used answers are evicted beyond it
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("SEFARIA_ANALYSIS_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Key of one cached answer: the same section of the same text, asked the same way of the same model.
+# The prompt itself is hashed too, so template edits and per-call inputs (like a passage) miss the cache.
+def analysis_key(ref, section, version, model, temperature, source_text, prompt):
+    return _digest(json.dumps(
+        [ref, section, version, model, temperature, _digest(source_text), _digest(prompt)],
+        ensure_ascii=False,
+    ))
+
+
+# Key of one section's answer; the answers the model sees before it (the rewrite, the translation and the sections it
+# depends on) are part of it.
+# An answer produced another way than the one call (mode, e.g. 'pipelined') gets a key of its own
+def section_key(ref, key, model, temperature, source_text, prompt, dependency_answers=(), mode=''):
+    section = f"{key}:{mode}" if mode else key
+    return analysis_key(ref, section, SECTIONS[key].version, model, temperature, source_text, '\n'.join(list(dependency_answers) + [prompt]))
+
+
+# SQLite-backed cache of LLM analysis answers, shared by every session and every app process
+class AnalysisCache:
+
+    def __init__(self, path=ANALYSIS_CACHE_PATH, max_bytes=ANALYSIS_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                '''CREATE TABLE IF NOT EXISTS analyses (
+                    key TEXT PRIMARY KEY,
+                    ref TEXT NOT NULL,
+                    section TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    used_at REAL NOT NULL
+                )'''
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS analyses_used_at ON analyses (used_at)")
+
+    # Same connection handling as the text cache: one per thread, WAL for concurrent processes
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute("SELECT response FROM analyses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE analyses SET used_at = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key, ref, section, response):
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, ref, section, response, size, created_at, used_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, ref, section, response, size, now, now),
+            )
+            self._evict(conn)
+
+    def size(self):
+        return self._connection().execute("SELECT COALESCE(SUM(size), 0) FROM analyses").fetchone()[0]
+
+    # Drop least recently used answers until the cache is back under 90% of its bound
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM analyses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - self.max_bytes * 0.9
+        freed = 0
+        keys = []
+        for key, size in conn.execute("SELECT key, size FROM analyses ORDER BY used_at"):
+            if freed >= target:
+                break
+            keys.append((key,))
+            freed += size
+        conn.executemany("DELETE FROM analyses WHERE key = ?", keys)
+
+
+# Process-wide analysis cache instance
+def get_analysis_cache():
+    return resource("analysis_cache", AnalysisCache)
@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from sefaria_bot.analysis import TextAnalysis
+from sefaria_bot.analysis_cache import get_analysis_cache
+from sefaria_bot.books import BOOKS, book_refs
+from sefaria_bot.llm import DEFAULT_POLICY, Completion
+from sefaria_bot.metrics import get_metrics
+from sefaria_bot.refs import InvalidRef, parse_ref
+from sefaria_bot.sections import ANALYZE_ALL_SECTIONS, BASE_SECTIONS
+from sefaria_bot.sefaria import fetch_segmented_text
+
+
+# Steps precomputed for every ref, in the order the app runs them
+BATCH_SECTIONS = BASE_SECTIONS + ANALYZE_ALL_SECTIONS
+
+# The Batch API takes at most 50,000 requests per input file
+BATCH_MAX_REQUESTS = int(os.getenv("LLM_BATCH_MAX_REQUESTS", "50000"))
+
+# Seconds between two status checks of a running batch
+BATCH_POLL_SECONDS = float(os.getenv("LLM_BATCH_POLL_SECONDS", "30"))
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+FINISHED_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+# The Batch API client; OPENAI_API_KEY and OPENAI_BASE_URL are read from the environment when not given
+def make_batch_client(api_key=None, base_url=None):
+    import openai
+    return openai.OpenAI(api_key=api_key, base_url=base_url)
+
+
+# Upload one JSONL input file, start a batch on it and wait until it finishes; returns the finished batch
+def run_batch(client, lines, poll_seconds=BATCH_POLL_SECONDS, out=sys.stdout):
+    data = ''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines).encode("utf-8")
+    input_file = client.files.create(file=("analyses.jsonl", data), purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h")
+    print(f"batch {batch.id}: {len(lines)} requests submitted", file=out)
+    last_status = None
+    while batch.status not in FINISHED_STATUSES:
+        time.sleep(poll_seconds)
+        batch = client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        status = (batch.status, counts.completed if counts else 0, counts.failed if counts else 0)
+        if status != last_status:
+            print(f"batch {batch.id}: {status[0]}, {status[1]}/{len(lines)} completed, {status[2]} failed", file=out)
+            last_status = status
+    return batch
+
+
+# The Completions of a finished batch by custom_id
+def batch_results(client, batch):
+    completions = {}
+    if not batch.output_file_id:
+        return completions
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            continue
+        body = response["body"]
+        usage = body.get("usage") or {}
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        completions[result["custom_id"]] = Completion(
+            body["choices"][0]["message"]["content"].strip(), body.get("model"),
+            usage.get("prompt_tokens", 0), cached_tokens, usage.get("completion_tokens", 0),
+        )
+    return completions
+
+
+# Precompute the rewrite, translation and every analysis section of the given refs into the shared analysis cache.
+# Each round sends, for every ref, the steps whose inputs are answered (rewrite, then translation, then the sections,
+# then the sections that build on other sections); answers already in the cache are not asked again, so an
+# interrupted run can simply be restarted.
+def precompute(refs, client, policy=DEFAULT_POLICY, cache=None, poll_seconds=BATCH_POLL_SECONDS,
+               max_requests=BATCH_MAX_REQUESTS, out=sys.stdout):
+    cache = cache or get_analysis_cache()
+    metrics = get_metrics()
+    started = time.monotonic()
+
+    analyses = []
+    failed_refs = 0
+    for ref in refs:
+        segments = fetch_segmented_text(ref)
+        if segments is None:
+            failed_refs += 1
+            print(f"failed to fetch: {ref}", file=out)
+            continue
+        analyses.append(TextAnalysis(ref, str(segments)))
+
+    cached = answered = failed = prompt_tokens = completion_tokens = 0
+    while True:
+        requests = {}
+        progress = True
+        while progress:
+            progress = False
+            for analysis in analyses:
+                for key in analysis.ready(BATCH_SECTIONS):
+                    custom_id = f"{analysis.ref}|{key}"
+                    if custom_id in requests:
+                        continue
+                    request = analysis.request(key, policy.model)
+                    response = cache.get(request.cache_key)
+                    if response is not None:
+                        analysis.answers[key] = response
+                        cached += 1
+                        progress = True
+                    else:
+                        requests[custom_id] = (analysis, request)
+        if not requests:
+            break
+
+        pending = list(requests.items())
+        round_answers = 0
+        for start in range(0, len(pending), max_requests):
+            chunk = pending[start:start + max_requests]
+            lines = [
+                {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": {
+                        "model": policy.model,
+                        "messages": request.messages,
+                        "max_tokens": policy.max_tokens,
+                        "temperature": request.temperature,
+                    },
+                }
+                for custom_id, (_, request) in chunk
+            ]
+            batch = run_batch(client, lines, poll_seconds, out)
+            completions = batch_results(client, batch)
+            for custom_id, (analysis, request) in chunk:
+                key = request.key
+                completion = completions.get(custom_id)
+                if completion is None:
+                    failed += 1
+                    print(f"failed: {key} of {analysis.ref}", file=out)
+                    continue
+                analysis.answers[key] = completion.text
+                cache.put(request.cache_key, analysis.ref, key, completion.text)
+                metrics.record_call(key, analysis.ref, policy.model, "ok", None, None, None, completion.prompt_tokens,
+                                    completion.cached_tokens, completion.completion_tokens, batch=True)
+                prompt_tokens += completion.prompt_tokens
+                completion_tokens += completion.completion_tokens
+                round_answers += 1
+        answered += round_answers
+        # Steps that failed (and what builds on them) are left for the next run
+        if round_answers == 0:
+            break
+
+    missing = sum(len(BATCH_SECTIONS) - len(analysis.answers) for analysis in analyses)
+    elapsed = time.monotonic() - started
+    print(f"done in {elapsed:.1f}s: {answered} answers precomputed ({prompt_tokens} prompt + {completion_tokens} output tokens), "
+          f"{cached} already cached, {failed} failed, {missing} missing, {failed_refs} refs not fetched", file=out)
+    return failed_refs == 0 and missing == 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute the analyses of whole books (or single refs) into the shared analysis cache through the OpenAI Batch API.")
+    parser.add_argument("targets", nargs="*", default=list(BOOKS), help=f"books or refs to precompute (default: all of {', '.join(BOOKS)})")
+    parser.add_argument("--poll", type=float, default=BATCH_POLL_SECONDS, help=f"seconds between batch status checks (default: {BATCH_POLL_SECONDS:g})")
+    parser.add_argument("--max-requests", type=int, default=BATCH_MAX_REQUESTS, help=f"requests per batch (default: {BATCH_MAX_REQUESTS})")
+    parser.add_argument("--base-url", help="Batch API base URL, e.g. a local stand-in (default: OPENAI_BASE_URL or api.openai.com)")
+    args = parser.parse_args(argv)
+
+    refs = []
+    for target in args.targets:
+        if target in BOOKS:
+            refs.extend(book_refs(BOOKS[target]))
+            continue
+        try:
+            refs.append(parse_ref(target).canonical)
+        except InvalidRef as e:
+            parser.error(f"{target!r} is neither a book nor a ref: {e}")
+
+    client = make_batch_client(base_url=args.base_url)
+    return 0 if precompute(refs, client, poll_seconds=args.poll, max_requests=args.max_requests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import argparse
+import itertools
+import json
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from sefaria_bot.llm import DEFAULT_POLICY, FakeBackend
+
+
+# Local stand-in for the OpenAI Files and Batch API: uploaded batches are answered by the fake LLM backend
+# on a background thread, so the batch pipeline runs end to end without a key or network
+class StubBatchServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 8766), latency=0.0, processing_delay=0.0):
+        super().__init__(address, _StubBatchHandler)
+        self.backend = FakeBackend(latency=latency, token_delay=0, error_rate=0, slow_rate=0)
+        self.processing_delay = processing_delay
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def new_id(self, prefix):
+        with self.lock:
+            return f"{prefix}-{next(self._ids)}"
+
+    def add_file(self, filename, purpose, content):
+        file = {
+            "id": self.new_id("file"),
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self.lock:
+            self.files[file["id"]] = (file, content)
+        return file
+
+    def create_batch(self, input_file_id, endpoint, completion_window):
+        batch = {
+            "id": self.new_id("batch"),
+            "object": "batch",
+            "endpoint": endpoint,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "validating",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self.lock:
+            self.batches[batch["id"]] = batch
+        threading.Thread(target=self._process, args=(batch,), daemon=True).start()
+        return batch
+
+    # Answer every request of the input file, then publish the output file and mark the batch completed
+    def _process(self, batch):
+        time.sleep(self.processing_delay)
+        _, content = self.files[batch["input_file_id"]]
+        requests = [json.loads(line) for line in content.decode("utf-8").splitlines() if line.strip()]
+        with self.lock:
+            batch["status"] = "in_progress"
+            batch["request_counts"]["total"] = len(requests)
+        results = []
+        for request in requests:
+            body = request["body"]
+            policy = DEFAULT_POLICY._replace(model=body["model"], max_tokens=body.get("max_tokens", DEFAULT_POLICY.max_tokens))
+            completion = self.backend.complete(body["messages"], body.get("temperature", 1), policy)
+            results.append({
+                "id": self.new_id("batch_req"),
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "request_id": self.new_id("req"),
+                    "body": {
+                        "id": self.new_id("chatcmpl"),
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": completion.model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": completion.text}, "finish_reason": "stop"}],
+                        "usage": {
+                            "prompt_tokens": completion.prompt_tokens,
+                            "completion_tokens": completion.completion_tokens,
+                            "total_tokens": completion.prompt_tokens + completion.completion_tokens,
+                            "prompt_tokens_details": {"cached_tokens": completion.cached_tokens},
+                        },
+                    },
+                },
+                "error": None,
+            })
+            with self.lock:
+                batch["request_counts"]["completed"] += 1
+        output = ''.join(json.dumps(result, ensure_ascii=False) + '\n' for result in results).encode("utf-8")
+        output_file = self.add_file("batch_output.jsonl", "batch_output", output)
+        with self.lock:
+            batch["output_file_id"] = output_file["id"]
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+
+
+class _StubBatchHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        server = self.server
+        path = urlsplit(self.path).path
+        body = self._body()
+        if path == "/v1/files":
+            # multipart/form-data with a "purpose" field and a "file" part
+            message = BytesParser(policy=HTTP).parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode("latin-1") + b"\r\n\r\n" + body
+            )
+            fields = {}
+            for part in message.iter_parts():
+                fields[part.get_param("name", header="content-disposition")] = part
+            file_part = fields.get("file")
+            if file_part is None:
+                return self._send(400, {"error": {"message": "Missing file"}})
+            purpose = fields["purpose"].get_content().strip() if "purpose" in fields else "batch"
+            return self._send(200, server.add_file(file_part.get_filename(), purpose, file_part.get_payload(decode=True)))
+        if path == "/v1/batches":
+            data = json.loads(body)
+            if data.get("input_file_id") not in server.files:
+                return self._send(400, {"error": {"message": f"No such file: {data.get('input_file_id')}"}})
+            return self._send(200, server.create_batch(data["input_file_id"], data["endpoint"], data["completion_window"]))
+        self._send(404, {"error": {"message": "Not found"}})
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        if parts[:2] == ["v1", "batches"] and len(parts) == 3 and parts[2] in server.batches:
+            with server.lock:
+                return self._send(200, dict(server.batches[parts[2]], request_counts=dict(server.batches[parts[2]]["request_counts"])))
+        if parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content" and parts[2] in server.files:
+            _, content = server.files[parts[2]]
+            return self._send_bytes(200, content, "application/octet-stream")
+        self._send(404, {"error": {"message": "Not found"}})
+
+    def _send(self, status, data):
+        self._send_bytes(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8")
+
+    def _send_bytes(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Start a stand-in server on a background thread (port 0 picks a free port); returns the server
+def start_batch_stub_server(port=0, **options):
+    server = StubBatchServer(("127.0.0.1", port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the OpenAI Files and Batch API locally, answering batches with the fake LLM backend.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency-ms", type=float, default=0, help="time spent answering each request of a batch")
+    parser.add_argument("--processing-delay-ms", type=float, default=0, help="time a batch stays in validation before it is processed")
+    args = parser.parse_args(argv)
+
+    server = StubBatchServer((args.host, args.port), latency=args.latency_ms / 1000, processing_delay=args.processing_delay_ms / 1000)
+    print(f"Serving Batch API stand-in, point the batch pipeline at it with:\n  python -m sefaria_bot.batch --base-url {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+from collections import namedtuple
+
+
+# A book offered in the "Choose your Text" selector
+#  - name: label shown to the user
+#  - title: how Sefaria addresses the book (for Shev Shmateta, the 'Shmatta' section of the work)
+#  - address: 'integer' for numbered chapters, 'talmud' for daf/amud (1a, 1b, 2a, ...)
+#  - sections: number of chapters, or of dapim for 'talmud' addressing
+#  - depth: how many levels a ref into the book can give: chapter and verse (2) for Genesis, daf and segment for
+#    the Tikkunei Zohar, shmatta, chapter and paragraph for Shev Shmateta
+#  - aliases: other spellings accepted in refs
+Book = namedtuple("Book", ["name", "title", "address", "sections", "depth", "aliases"])
+
+BOOKS = {
+    "Shev Shmayasa": Book("Shev Shmayasa", "Shev Shmateta, Shmatta", "integer", 7, 3, ("Shev Shmateta", "Shev Shmatteta")),
+    "Tikkunei Zohar": Book("Tikkunei Zohar", "Tikkunei Zohar", "talmud", 147, 2, ("Tikunei Zohar",)),
+    "Genesis": Book("Genesis", "Genesis", "integer", 50, 2, ("Bereshit", "Bereishit")),
+}
+
+
+# Every chapter or amud of a book, in reading order
+def book_sections(book):
+    if book.address == 'talmud':
+        return [f"{daf}{amud}" for daf in range(1, book.sections + 1) for amud in ('a', 'b')]
+    return [str(chapter) for chapter in range(1, book.sections + 1)]
+
+
+# Every canonical Sefaria ref of a book, in reading order
+def book_refs(book):
+    return [f"{book.title} {section}" for section in book_sections(book)]
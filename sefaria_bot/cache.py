@@ -0,0 +1,82 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from sefaria_bot.resources import resource
+
+
+# Location of the on-disk cache, shared by every session and every app variant
+CACHE_PATH = os.getenv(
+    "SEFARIA_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "sefaria_bot", "sefaria.sqlite3"),
+)
+
+# How long (in seconds) a cached text is served without asking Sefaria again
+FRESH_SECONDS = int(os.getenv("SEFARIA_CACHE_FRESH_SECONDS", str(7 * 24 * 3600)))
+
+
+# One cached Sefaria response, with the validators needed to revalidate it
+CacheEntry = namedtuple("CacheEntry", ["ref", "payload", "etag", "last_modified", "fetched_at"])
+
+
+# SQLite-backed cache of Sefaria /api/texts/ responses, keyed by canonical ref
+class TextCache:
+
+    def __init__(self, path=CACHE_PATH, fresh_seconds=FRESH_SECONDS):
+        self.path = path
+        self.fresh_seconds = fresh_seconds
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                '''CREATE TABLE IF NOT EXISTS texts (
+                    ref TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at REAL NOT NULL
+                )'''
+            )
+
+    # SQLite connections can't be shared between threads, and Streamlit runs every session on its own thread
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            # WAL lets several app processes read while one of them writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, ref):
+        row = self._connection().execute(
+            "SELECT ref, payload, etag, last_modified, fetched_at FROM texts WHERE ref = ?", (ref,)
+        ).fetchone()
+        if row is None:
+            return None
+        return CacheEntry(row[0], json.loads(row[1]), row[2], row[3], row[4])
+
+    def put(self, ref, payload, etag=None, last_modified=None):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO texts (ref, payload, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (ref, json.dumps(payload, ensure_ascii=False), etag, last_modified, time.time()),
+            )
+
+    # Sefaria confirmed (304) that our copy is still current
+    def touch(self, ref):
+        with self._connection() as conn:
+            conn.execute("UPDATE texts SET fetched_at = ? WHERE ref = ?", (time.time(), ref))
+
+    def is_fresh(self, entry):
+        return time.time() - entry.fetched_at < self.fresh_seconds
+
+
+# Process-wide cache instance
+def get_cache():
+    return resource("cache", TextCache)
@@ -0,0 +1,137 @@
+import os
+import sys
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# Input tokens a conversation may send per call; older turns are compacted beyond it
+HISTORY_TOKEN_BUDGET = int(os.getenv("LLM_HISTORY_TOKEN_BUDGET", "8000"))
+
+# The last few messages (the current question and the answers it most likely refers to) are always sent whole
+KEEP_RECENT_MESSAGES = int(os.getenv("LLM_HISTORY_KEEP_RECENT", "4"))
+
+# Length of each compacted turn in the summary of earlier turns
+COMPACT_TURN_TOKENS = 60
+
+# Per-message framing tokens the chat format adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    return _encoding
+
+
+# Local token count: exact with tiktoken, otherwise a heuristic (~4 Latin characters or ~2.5 Hebrew characters per token)
+def count_tokens(text):
+    if tiktoken is not None:
+        return len(_get_encoding().encode(text))
+    ascii_chars = sum(1 for c in text if c < '\x80')
+    return int(ascii_chars / 4 + (len(text) - ascii_chars) / 2.5) + 1
+
+
+# The beginning of a text, cut to about max_tokens tokens
+def truncate_tokens(text, max_tokens):
+    if tiktoken is not None:
+        tokens = _get_encoding().encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return _get_encoding().decode(tokens[:max_tokens]).rstrip() + '…'
+    if count_tokens(text) <= max_tokens:
+        return text
+    words = text.split()
+    kept = []
+    used = 0
+    for word in words:
+        used += count_tokens(word + ' ')
+        if used > max_tokens:
+            break
+        kept.append(word)
+    return ' '.join(kept) + '…'
+
+
+# A conversation that keeps every message but sends the model only what fits in its token budget.
+# The system prompt and pinned messages (the source text and its translation) are always sent whole,
+# and so are the last few messages; the turns in between are compacted into one summary message,
+# oldest first dropped if even that doesn't fit.
+class ConversationHistory:
+
+    def __init__(self, system_prompt, budget=HISTORY_TOKEN_BUDGET, keep_recent=KEEP_RECENT_MESSAGES):
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.messages = []
+        self.tokens = []
+        self.pinned = set()
+        self.append("system", system_prompt, pin=True)
+
+    def append(self, role, content, pin=False):
+        if pin:
+            self.pinned.add(len(self.messages))
+        self.messages.append({"role": role, "content": content})
+        self.tokens.append(count_tokens(content) + MESSAGE_OVERHEAD_TOKENS)
+
+    # Takes back the last message, e.g. a question whose answer never came
+    def pop(self):
+        self.pinned.discard(len(self.messages) - 1)
+        self.tokens.pop()
+        return self.messages.pop()
+
+    # Unpins everything but the system prompt, e.g. when the conversation moves on to another text: the earlier
+    # text's turns become ordinary history, compacted like any other
+    def unpin(self):
+        self.pinned = {0}
+
+    def __len__(self):
+        return len(self.messages)
+
+    def total_tokens(self):
+        return sum(self.tokens)
+
+    # The pinned messages (system prompt and source text) and their token count, the base that independent requests fork from
+    def base(self):
+        return [self.messages[i] for i in sorted(self.pinned)], sum(self.tokens[i] for i in self.pinned)
+
+    # The messages to send and how many input tokens compaction saved compared to sending everything
+    def context(self):
+        total = self.total_tokens()
+        if total <= self.budget:
+            return list(self.messages), 0
+
+        recent_start = max(1, len(self.messages) - self.keep_recent)
+        kept = [i for i in range(recent_start) if i in self.pinned]
+        fixed_tokens = sum(self.tokens[i] for i in kept) + sum(self.tokens[recent_start:])
+        # Pins that don't fit next to the recent messages are compacted like the other turns, oldest first;
+        # the system prompt always stays
+        while fixed_tokens > self.budget and len(kept) > 1:
+            fixed_tokens -= self.tokens[kept.pop(1)]
+        if fixed_tokens > self.budget:
+            print(f"Conversation context over its budget: the last {len(self.messages) - recent_start} messages alone are "
+                  f"{fixed_tokens} tokens, the budget is {self.budget}", file=sys.stderr)
+        middle = [i for i in range(recent_start) if i not in kept]
+
+        lines = []
+        for i in middle:
+            message = self.messages[i]
+            speaker = "User" if message["role"] == "user" else "Assistant"
+            lines.append(f"- {speaker}: {truncate_tokens(' '.join(message['content'].split()), COMPACT_TURN_TOKENS)}")
+        while lines:
+            summary = "Summary of the earlier part of this conversation:\n" + "\n".join(lines)
+            summary_tokens = count_tokens(summary) + MESSAGE_OVERHEAD_TOKENS
+            if fixed_tokens + summary_tokens <= self.budget:
+                break
+            lines.pop(0)
+
+        messages = [self.messages[i] for i in kept]
+        sent = fixed_tokens
+        if lines:
+            messages.append({"role": "system", "content": summary})
+            sent += summary_tokens
+        messages.extend(self.messages[recent_start:])
+        return messages, max(0, total - sent)
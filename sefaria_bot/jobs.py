@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sefaria_bot.resources import resource
+
+
+# Worker threads of the job pool; enough for every session's jobs to reach the rate limiter, which decides who goes first
+JOB_WORKERS = int(os.getenv("SEFARIA_JOB_WORKERS", "32"))
+
+# Seconds a finished job is kept for its session to pick up; jobs of sessions that went away are dropped after it
+JOB_RESULT_TTL = float(os.getenv("SEFARIA_JOB_RESULT_TTL", "3600"))
+
+# How often (seconds) the watched sessions are checked; the jobs of a session that left are cancelled
+JOB_REAP_INTERVAL = float(os.getenv("SEFARIA_JOB_REAP_INTERVAL", "5"))
+
+
+# One piece of background work of a session (e.g. one section): its future, its place in line while the rate
+# limiter holds it back, and the text streamed so far. Worker threads only write plain attributes; the page reads them.
+# The job is also the handle to cancel the work: the work passes job.cancelled on to the calls it makes.
+class Job:
+
+    def __init__(self, session, name, inputs=None):
+        self.session = session
+        self.name = name
+        self.inputs = inputs
+        self.started = time.monotonic()
+        self.finished_at = None
+        self.position = None
+        self.text = ''
+        self.first_token_seconds = None
+        self.cancelled = threading.Event()
+        self.future = None
+
+    # Give up on the work: a job still queued never runs, a running one stops at its next check of job.cancelled
+    def cancel(self):
+        self.cancelled.set()
+        self.future.cancel()
+
+    def on_wait(self, position):
+        self.position = position
+
+    def on_delta(self, piece):
+        if not self.text:
+            self.first_token_seconds = time.monotonic() - self.started
+        self.text += piece
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+    # Seconds from submission to the end of the work (so far, while it runs)
+    def seconds(self):
+        return (self.finished_at or time.monotonic()) - self.started
+
+    def _finished(self, future):
+        self.finished_at = time.monotonic()
+
+
+# Process-wide table of background jobs keyed by (session, name), run on one worker pool. The work outlives the
+# Streamlit run that submitted it: a rerun (even one that interrupted the script) finds the job running or finished
+# under the same key, and submitting a job that is already there for the same inputs returns it instead of paying for
+# the same answer twice.
+class JobTable:
+
+    def __init__(self, max_workers=JOB_WORKERS, result_ttl=JOB_RESULT_TTL, reap_interval=JOB_REAP_INTERVAL):
+        self.result_ttl = result_ttl
+        self.reap_interval = reap_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._watched = {}
+        self._reaper = None
+        self._lock = threading.Lock()
+
+    # Run fn(job, *args, **kwargs) on the pool as the session's job `name` working on `inputs` (anything comparable,
+    # e.g. the values of its prompt). The job already under that name is returned when its inputs are the same; one
+    # working on other inputs (another passage to simplify) is cancelled and replaced
+    def submit(self, session, name, inputs, fn, *args, **kwargs):
+        with self._lock:
+            self._prune()
+            job = self._jobs.get((session, name))
+            if job is not None:
+                if job.inputs == inputs:
+                    return job
+                job.cancel()
+            job = Job(session, name, inputs)
+            job.future = self._executor.submit(fn, job, *args, **kwargs)
+            job.future.add_done_callback(job._finished)
+            self._jobs[(session, name)] = job
+            return job
+
+    def get(self, session, name):
+        with self._lock:
+            return self._jobs.get((session, name))
+
+    # Forget a job, once its session has its result
+    def pop(self, session, name):
+        with self._lock:
+            return self._jobs.pop((session, name), None)
+
+    # Cancel and forget every job of a session, e.g. when it moves to another text
+    def discard(self, session):
+        with self._lock:
+            for key in [key for key in self._jobs if key[0] == session]:
+                self._jobs.pop(key).cancel()
+
+    # Cancel the session's jobs once alive() says it went away (the browser tab was closed); alive is called from
+    # the reaper thread every reap_interval seconds. Watching again replaces the check
+    def watch(self, session, alive):
+        with self._lock:
+            self._watched[session] = alive
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, name="job-reaper", daemon=True)
+                self._reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(self.reap_interval)
+            with self._lock:
+                watched = list(self._watched.items())
+            for session, alive in watched:
+                try:
+                    gone = not alive()
+                except Exception:
+                    gone = False
+                if gone:
+                    with self._lock:
+                        if self._watched.get(session) is alive:
+                            del self._watched[session]
+                    self.discard(session)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def _prune(self):
+        now = time.monotonic()
+        expired = [key for key, job in self._jobs.items() if job.finished_at is not None and now - job.finished_at > self.result_ttl]
+        for key in expired:
+            del self._jobs[key]
+
+
+# Process-wide job table
+def get_job_table():
+    return resource("jobs", JobTable)
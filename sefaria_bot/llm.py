@@ -0,0 +1,588 @@
+import hashlib
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from sefaria_bot.history import MESSAGE_OVERHEAD_TOKENS, count_tokens
+from sefaria_bot.metrics import get_metrics
+from sefaria_bot.resources import resource
+
+
+# Which backend answers the calls: "openai", or "fake" for a deterministic local stand-in
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+
+# Default per-call policy; any of it can be overridden on a single call
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "1500"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+# Time a call gets overall, retries included (for a streamed answer: until its first token)
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "90"))
+# Model asked instead when the primary misses its deadline or keeps failing; empty for none
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+# Send a second, identical request when the first is slower than most (non-streamed calls only)
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+
+# Decorrelated jitter between retries: each wait is drawn between the base and three times the previous wait, up to the cap
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "0.5"))
+LLM_RETRY_CAP = float(os.getenv("LLM_RETRY_CAP", "8"))
+
+# Hedged requests fire after the p95 latency of the model's recent calls, or after this many seconds until enough calls were seen
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "10"))
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+# How many calls one process runs in parallel for submit()
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# Provider rate limits shared by every call of the process (requests and input + output tokens per minute); 0 disables a limit
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+
+# Priority classes of the rate limiter: a student waiting on an answer goes before work running in the background
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Simulated latency of the fake backend (seconds before the first token, then per token)
+FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", "0"))
+FAKE_TOKEN_DELAY = float(os.getenv("LLM_FAKE_TOKEN_DELAY", "0"))
+# Simulated bad minutes of the fake backend: fraction of calls failing with a 429 or 503, and of calls ten times slower
+FAKE_ERROR_RATE = float(os.getenv("LLM_FAKE_ERROR_RATE", "0"))
+FAKE_SLOW_RATE = float(os.getenv("LLM_FAKE_SLOW_RATE", "0"))
+
+
+# Model, output cap, timeout of one attempt (seconds), retry count, overall deadline (seconds),
+# fallback model and hedging for one call
+Policy = namedtuple("Policy", ["model", "max_tokens", "timeout", "retries", "deadline", "fallback_model", "hedge"])
+
+DEFAULT_POLICY = Policy(LLM_MODEL, LLM_MAX_TOKENS, LLM_TIMEOUT, LLM_RETRIES, LLM_DEADLINE, LLM_FALLBACK_MODEL, LLM_HEDGE)
+
+
+# A call that didn't get its answer before its deadline
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+# A call its caller gave up on (e.g. the student moved to another text), through the threading.Event passed as cancel
+class Cancelled(Exception):
+    pass
+
+
+# Longest a cancellable call sleeps or waits without checking whether it was cancelled (seconds)
+CANCEL_CHECK_INTERVAL = 0.25
+
+# Sleep, or raise Cancelled as soon as the cancel event is set
+def _sleep(seconds, cancel=None):
+    if cancel is None:
+        time.sleep(seconds)
+    elif cancel.wait(seconds):
+        raise Cancelled("The call was cancelled")
+
+
+# A finished completion with its token usage; cached_tokens is the part of prompt_tokens the provider
+# served from its prompt cache (a prefix identical to an earlier request)
+Completion = namedtuple("Completion", ["text", "model", "prompt_tokens", "cached_tokens", "completion_tokens"])
+
+
+def _usage(usage):
+    if usage is None:
+        return 0, 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    return usage.prompt_tokens, cached, usage.completion_tokens
+
+
+# Chat completions from the OpenAI API
+class OpenAIBackend:
+
+    name = "openai"
+
+    def __init__(self, api_key=None):
+        import openai
+        self.client = openai.OpenAI(api_key=api_key)
+
+    # Retries are the gateway's job, so it can spread them with jitter and keep them within the deadline
+    def _client(self, policy):
+        return self.client.with_options(timeout=policy.timeout, max_retries=0)
+
+    # Rate limits, server errors, timeouts and dropped connections are worth another attempt; bad requests are not
+    def retryable(self, error):
+        import openai
+        if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+    def complete(self, messages, temperature, policy):
+        completion = self._client(policy).chat.completions.create(
+            model=policy.model,
+            messages=messages,
+            max_tokens=policy.max_tokens,
+            temperature=temperature
+        )
+        return Completion(completion.choices[0].message.content.strip(), completion.model, *_usage(completion.usage))
+
+    # Yields the text of the answer piece by piece as the API sends it, then the whole Completion
+    def stream(self, messages, temperature, policy):
+        stream = self._client(policy).chat.completions.create(
+            model=policy.model,
+            messages=messages,
+            max_tokens=policy.max_tokens,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        pieces = []
+        model = policy.model
+        usage = None
+        try:
+            for chunk in stream:
+                model = chunk.model or model
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    pieces.append(chunk.choices[0].delta.content)
+                    yield pieces[-1]
+        finally:
+            # A reader that stops early (a cancelled call) closes the connection, so the provider stops generating
+            stream.close()
+        yield Completion(''.join(pieces).strip(), model, *_usage(usage))
+
+
+# Error of the fake backend, with the HTTP status the provider would have answered
+class FakeBackendError(Exception):
+
+    def __init__(self, status_code, message):
+        super().__init__(f"{status_code} {message}")
+        self.status_code = status_code
+
+
+# Deterministic local stand-in: the same messages always get the same answer, no network or key needed.
+# It also mimics the provider's prompt cache at message granularity, counting words as tokens,
+# and can simulate errors, slow calls and timeouts.
+class FakeBackend:
+
+    name = "fake"
+
+    def __init__(self, api_key=None, latency=FAKE_LATENCY, token_delay=FAKE_TOKEN_DELAY, error_rate=FAKE_ERROR_RATE,
+                 slow_rate=FAKE_SLOW_RATE, seed=None):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.random = random.Random(seed)
+        self._seen_prefixes = set()
+        self._lock = threading.Lock()
+
+    def retryable(self, error):
+        return isinstance(error, FakeBackendError) and (error.status_code == 429 or error.status_code >= 500)
+
+    # Waits out the latency of one call, failing like the provider would on a bad minute or past the timeout
+    def _wait(self, seconds, policy):
+        with self._lock:
+            error_roll, slow_roll, status = self.random.random(), self.random.random(), self.random.choice((429, 503))
+        if error_roll < self.error_rate:
+            raise FakeBackendError(status, "Injected failure")
+        if slow_roll < self.slow_rate:
+            seconds *= 10
+        if seconds > policy.timeout:
+            time.sleep(policy.timeout)
+            raise FakeBackendError(504, "Timed out")
+        time.sleep(seconds)
+
+    # Prompt tokens, and how many of them belong to the longest message prefix already sent
+    def _prompt_usage(self, messages):
+        prompt_tokens = 0
+        cached_tokens = 0
+        digest = hashlib.sha256()
+        with self._lock:
+            for message in messages:
+                digest.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+                prompt_tokens += len(message["content"].split())
+                if digest.hexdigest() in self._seen_prefixes:
+                    cached_tokens = prompt_tokens
+                self._seen_prefixes.add(digest.hexdigest())
+        return prompt_tokens, cached_tokens
+
+    def _answer(self, messages, temperature, policy):
+        digest = hashlib.sha256(
+            json.dumps([messages, temperature, policy.model], ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        question = ' '.join(messages[-1]["content"].split()) if messages else ''
+        words = ["Fake", "answer", digest[:12], "from", policy.model + ":"] + question.split()[:40]
+        return words[:policy.max_tokens]
+
+    def complete(self, messages, temperature, policy):
+        words = self._answer(messages, temperature, policy)
+        self._wait(self.latency + self.token_delay * len(words), policy)
+        return Completion(' '.join(words), policy.model, *self._prompt_usage(messages), len(words))
+
+    def stream(self, messages, temperature, policy):
+        words = self._answer(messages, temperature, policy)
+        self._wait(self.latency, policy)
+        for i, word in enumerate(words):
+            time.sleep(self.token_delay)
+            yield word if i == 0 else ' ' + word
+        yield Completion(' '.join(words), policy.model, *self._prompt_usage(messages), len(words))
+
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "fake": FakeBackend,
+}
+
+
+# Build a backend by name
+def make_backend(name=LLM_BACKEND, api_key=None):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name](api_key=api_key)
+
+
+# Process-wide admission control in front of the provider: two token buckets (requests and tokens per minute)
+# refilled continuously. Calls over capacity wait in line, highest priority first then first come first served,
+# instead of being sent and failing with a 429; on_wait is told their position in line (1 is next) and 0 once admitted.
+# A call whose cancel event is set leaves the line with Cancelled.
+class RateLimiter:
+
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests = float(requests_per_minute)
+        self.tokens = float(tokens_per_minute)
+        self.refilled_at = time.monotonic()
+        self.waiting = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.refilled_at
+        self.refilled_at = now
+        self.requests = min(self.requests_per_minute, self.requests + elapsed * self.requests_per_minute / 60)
+        self.tokens = min(self.tokens_per_minute, self.tokens + elapsed * self.tokens_per_minute / 60)
+
+    # Seconds until both buckets hold enough for a call of that many tokens (0 if they already do)
+    def _delay(self, tokens):
+        delay = 0.0
+        if self.requests_per_minute and self.requests < 1:
+            delay = max(delay, (1 - self.requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self.tokens < tokens:
+            delay = max(delay, (tokens - self.tokens) * 60 / self.tokens_per_minute)
+        return delay
+
+    # Waits until the call may go, then takes its share of both buckets; returns the tokens taken, for release()
+    def acquire(self, tokens, priority=PRIORITY_INTERACTIVE, on_wait=None, cancel=None):
+        if self.tokens_per_minute:
+            # A call larger than the whole bucket would never fit; it goes when the bucket is full
+            tokens = min(tokens, self.tokens_per_minute)
+        entry = (priority, next(self._order))
+        reported = None
+        with self._condition:
+            self.waiting.append(entry)
+            try:
+                while True:
+                    if cancel is not None and cancel.is_set():
+                        raise Cancelled("The call was cancelled while waiting for capacity")
+                    self._refill()
+                    position = sorted(self.waiting).index(entry)
+                    delay = self._delay(tokens)
+                    if position == 0 and delay == 0:
+                        break
+                    if on_wait is not None and position + 1 != reported:
+                        reported = position + 1
+                        on_wait(reported)
+                    # Only the first in line knows how long it waits; the others are woken when the line moves
+                    timeout = delay if position == 0 else 1.0
+                    self._condition.wait(min(timeout, CANCEL_CHECK_INTERVAL) if cancel is not None else timeout)
+            finally:
+                self.waiting.remove(entry)
+                self._condition.notify_all()
+            if self.requests_per_minute:
+                self.requests -= 1
+            if self.tokens_per_minute:
+                self.tokens -= tokens
+        if reported is not None:
+            on_wait(0)
+        return tokens
+
+    # Settles a call: the reservation is replaced by the tokens it actually used (or the gateway's estimate of them)
+    def release(self, reserved, used):
+        if not self.tokens_per_minute:
+            return
+        with self._condition:
+            self._refill()
+            self.tokens = min(self.tokens_per_minute, self.tokens + reserved - used)
+            self._condition.notify_all()
+
+    # How many calls are waiting for capacity
+    def queue_length(self):
+        with self._condition:
+            return len(self.waiting)
+
+
+# Tokens a call may use: its prompt, counted locally, plus its output cap
+def estimate_tokens(messages, policy):
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages) + policy.max_tokens
+
+
+# What one call went through, for the metrics: time waiting for capacity, attempts, first token, the model asked last
+class _CallStats:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.queue_seconds = 0.0
+        self.attempts = 0
+        self.first_token_at = None
+        self.model = None
+
+
+# The single entry point for every LLM call, so policy and cross-cutting concerns live in one place
+class Gateway:
+
+    def __init__(self, backend, policy=DEFAULT_POLICY, max_concurrency=LLM_MAX_CONCURRENCY, limiter=None, metrics=None):
+        self.backend = backend
+        self.policy = policy
+        self.limiter = limiter or RateLimiter()
+        self.metrics = metrics
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        # Attempts run here so a caller can give up on one at its deadline, or race it against a hedged copy
+        self._attempts = ThreadPoolExecutor(max_workers=max_concurrency * 4, thread_name_prefix="llm-attempt")
+        self._latencies = {}
+        self._latencies_lock = threading.Lock()
+
+    # The default policy with some fields overridden, e.g. policy_for(max_tokens=300)
+    def policy_for(self, **overrides):
+        return self.policy._replace(**overrides)
+
+    def _record_latency(self, model, seconds):
+        with self._latencies_lock:
+            self._latencies.setdefault(model, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    # When to send a hedged copy of a call: the p95 latency of the model's recent calls
+    def hedge_delay(self, model):
+        with self._latencies_lock:
+            latencies = sorted(self._latencies.get(model, ()))
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DELAY
+        return latencies[int(len(latencies) * 0.95)]
+
+    # Takes the call's share of the rate limiter, timing the wait
+    def _acquire(self, messages, policy, priority, on_wait, stats, cancel=None):
+        waited_from = time.monotonic()
+        stats.model = policy.model
+        reserved = self.limiter.acquire(estimate_tokens(messages, policy), priority, on_wait, cancel)
+        stats.queue_seconds += time.monotonic() - waited_from
+        stats.attempts += 1
+        return reserved
+
+    # One event per call in the metrics, tagged with what the caller passed (section, ref)
+    def _record(self, tags, status, stats, completion=None):
+        if self.metrics is None:
+            return
+        tags = tags or {}
+        ttft = stats.first_token_at - stats.started if stats.first_token_at is not None else None
+        usage = {}
+        if completion is not None:
+            usage = {"prompt_tokens": completion.prompt_tokens, "cached_tokens": completion.cached_tokens,
+                     "completion_tokens": completion.completion_tokens}
+        self.metrics.record_call(tags.get("section", "other"), tags.get("ref"), stats.model, status, stats.queue_seconds,
+                                 ttft, time.monotonic() - stats.started, attempts=stats.attempts, **usage)
+
+    def _recoverable(self, error):
+        return isinstance(error, DeadlineExceeded) or self.backend.retryable(error)
+
+    # The policies to try in turn: the call's own, then its fallback model
+    def _policies(self, policy):
+        policies = [policy]
+        if policy.fallback_model and policy.fallback_model != policy.model:
+            policies.append(policy._replace(model=policy.fallback_model, fallback_model=''))
+        return policies
+
+    # Decorrelated jitter: the next wait before a retry, or a DeadlineExceeded if it would end past the deadline
+    def _backoff(self, previous, deadline_at, error):
+        delay = min(LLM_RETRY_CAP, random.uniform(LLM_RETRY_BASE, previous * 3))
+        if time.monotonic() + delay >= deadline_at:
+            raise DeadlineExceeded(f"No answer before the deadline: {error}") from error
+        return delay
+
+    # What a call whose usage wasn't reported (it failed, was cancelled or the backend didn't say) spent: its prompt,
+    # the reservation less the output allowance, and the text it got out. The rest goes back to the token bucket
+    def _spent(self, reserved, policy, text=''):
+        return min(reserved, max(0, reserved - policy.max_tokens) + count_tokens(text))
+
+    # One backend call whose rate-limiter share was already taken; the share is settled with the actual usage
+    def _call(self, messages, temperature, policy, reserved):
+        started = time.monotonic()
+        used = self._spent(reserved, policy)
+        try:
+            completion = self.backend.complete(messages, temperature, policy)
+            used = completion.prompt_tokens + completion.completion_tokens or self._spent(reserved, policy, completion.text)
+            self._record_latency(policy.model, time.monotonic() - started)
+            return completion
+        finally:
+            self.limiter.release(reserved, used)
+
+    def _hedged_call(self, messages, temperature, policy, priority, on_wait=None, cancel=None):
+        reserved = self.limiter.acquire(estimate_tokens(messages, policy), priority, on_wait, cancel)
+        return self._call(messages, temperature, policy, reserved)
+
+    # One attempt, given up at the deadline; with hedging, a copy is sent once the first is slower than the
+    # model's p95, and whichever answers first wins
+    def _attempt(self, messages, temperature, policy, priority, on_wait, deadline_at, stats, cancel=None):
+        reserved = self._acquire(messages, policy, priority, on_wait, stats, cancel)
+        started = time.monotonic()
+        remaining = deadline_at - started
+        if remaining <= 0:
+            # Nothing was sent, so the whole share goes back
+            self.limiter.release(reserved, 0)
+            raise DeadlineExceeded("No answer before the deadline: the call waited too long for capacity")
+        policy = policy._replace(timeout=min(policy.timeout, remaining))
+        futures = [self._attempts.submit(self._call, messages, temperature, policy, reserved)]
+        hedge_at = started + self.hedge_delay(policy.model) if policy.hedge else None
+        while True:
+            now = time.monotonic()
+            if now >= deadline_at:
+                raise DeadlineExceeded(f"No answer from {policy.model} before the deadline")
+            if cancel is not None and cancel.is_set():
+                # A request already sent can't be called back; its share is settled when it returns
+                raise Cancelled("The call was cancelled")
+            timeout = deadline_at - now
+            if hedge_at is not None:
+                timeout = min(timeout, max(0, hedge_at - now))
+            if cancel is not None:
+                timeout = min(timeout, CANCEL_CHECK_INTERVAL)
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                futures.remove(future)
+                # A failure is left to the retries (with their backoff) once nothing else is still running
+                if not futures:
+                    raise future.exception()
+            if hedge_at is not None and time.monotonic() >= hedge_at:
+                futures.append(self._attempts.submit(self._hedged_call, messages, temperature, policy, priority, on_wait, cancel))
+                hedge_at = None
+
+    # Attempts of one model until one answers: retryable errors are retried with jitter while the deadline allows
+    def _complete_until(self, messages, temperature, policy, priority, on_wait, deadline_at, stats, cancel=None):
+        delay = LLM_RETRY_BASE
+        for attempt in range(policy.retries + 1):
+            try:
+                return self._attempt(messages, temperature, policy, priority, on_wait, deadline_at, stats, cancel)
+            except Exception as error:
+                if isinstance(error, DeadlineExceeded) or not self.backend.retryable(error) or attempt == policy.retries:
+                    raise
+                delay = self._backoff(delay, deadline_at, error)
+                _sleep(delay, cancel)
+
+    # on_wait gets the call's position in line while the rate limiter holds it back, and 0 once it is sent.
+    # The call is retried within its deadline, then handed to the fallback model if it still has no answer.
+    # tags (section, ref) label the call in the metrics. Setting the cancel event (a threading.Event) gives up on the call.
+    def complete_with_usage(self, messages, temperature=0.5, policy=None, priority=PRIORITY_INTERACTIVE, on_wait=None, tags=None,
+                            cancel=None):
+        policies = self._policies(policy or self.policy)
+        stats = _CallStats()
+        for i, policy in enumerate(policies):
+            try:
+                completion = self._complete_until(messages, temperature, policy, priority, on_wait, time.monotonic() + policy.deadline,
+                                                  stats, cancel)
+                break
+            except Cancelled:
+                self._record(tags, "cancelled", stats)
+                raise
+            except Exception as error:
+                if i == len(policies) - 1 or not self._recoverable(error):
+                    self._record(tags, "timeout" if isinstance(error, DeadlineExceeded) else "error", stats)
+                    raise
+        self._record(tags, "ok", stats, completion)
+        return completion
+
+    # Returns the answer text
+    def complete(self, messages, temperature=0.5, policy=None, priority=PRIORITY_INTERACTIVE, on_wait=None, tags=None, cancel=None):
+        return self.complete_with_usage(messages, temperature, policy, priority, on_wait, tags, cancel).text
+
+    # Runs the call on the gateway's thread pool and returns a Future of its Completion; on_wait is called from that thread
+    def submit(self, messages, temperature=0.5, policy=None, priority=PRIORITY_BACKGROUND, on_wait=None, tags=None, cancel=None):
+        return self.run_in_pool(self.complete_with_usage, messages, temperature, policy, priority, on_wait, tags, cancel)
+
+    # Runs fn(*args, **kwargs), work that makes LLM calls (e.g. a whole analysis step), on the gateway's thread pool
+    def run_in_pool(self, fn, *args, **kwargs):
+        return self._executor.submit(fn, *args, **kwargs)
+
+    # Streamed attempts of one model; once the first piece is out the answer can't be restarted, so errors
+    # are only retried (and the deadline only applies) before it
+    def _stream_until(self, messages, temperature, policy, on_complete, priority, on_wait, deadline_at, stats, cancel=None):
+        delay = LLM_RETRY_BASE
+        for attempt in range(policy.retries + 1):
+            reserved = self._acquire(messages, policy, priority, on_wait, stats, cancel)
+            used = None
+            streamed = []
+            try:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    used = 0
+                    raise DeadlineExceeded("No answer before the deadline: the call waited too long for capacity")
+                pieces = self.backend.stream(messages, temperature, policy._replace(timeout=min(policy.timeout, remaining)))
+                try:
+                    for piece in pieces:
+                        if isinstance(piece, Completion):
+                            used = piece.prompt_tokens + piece.completion_tokens or None
+                            if on_complete is not None:
+                                on_complete(piece)
+                        else:
+                            if cancel is not None and cancel.is_set():
+                                raise Cancelled("The call was cancelled")
+                            if stats.first_token_at is None:
+                                stats.first_token_at = time.monotonic()
+                            streamed.append(piece)
+                            yield piece
+                finally:
+                    # Stops the request when the caller gave up on it
+                    pieces.close()
+                return
+            except Exception as error:
+                if stats.first_token_at is not None or isinstance(error, DeadlineExceeded) or not self.backend.retryable(error) or attempt == policy.retries:
+                    raise
+                delay = self._backoff(delay, deadline_at, error)
+            finally:
+                # A stream that failed, was cancelled or didn't report usage spent its prompt and the pieces so far
+                if used is None:
+                    used = self._spent(reserved, policy, ''.join(streamed))
+                self.limiter.release(reserved, used)
+            _sleep(delay, cancel)
+
+    # Yields the answer text piece by piece; on_complete gets the whole Completion (with usage) at the end.
+    # Setting the cancel event, or closing the generator, stops the request and frees its unused rate-limiter share.
+    def stream(self, messages, temperature=0.5, policy=None, on_complete=None, priority=PRIORITY_INTERACTIVE, on_wait=None, tags=None,
+               cancel=None):
+        policies = self._policies(policy or self.policy)
+        stats = _CallStats()
+        completions = []
+        for i, policy in enumerate(policies):
+            try:
+                yield from self._stream_until(messages, temperature, policy, completions.append, priority, on_wait,
+                                              time.monotonic() + policy.deadline, stats, cancel)
+                break
+            except (Cancelled, GeneratorExit):
+                # The caller stopped reading, or cancelled the call
+                self._record(tags, "cancelled", stats)
+                raise
+            except Exception as error:
+                if stats.first_token_at is not None or i == len(policies) - 1 or not self._recoverable(error):
+                    self._record(tags, "timeout" if isinstance(error, DeadlineExceeded) else "error", stats)
+                    raise
+        completion = completions[-1] if completions else None
+        self._record(tags, "ok", stats, completion)
+        if completion is not None and on_complete is not None:
+            on_complete(completion)
+
+
+# Process-wide gateway, and with it the one OpenAI client whose connection pool every call reuses;
+# the API key is only used when the first call creates it
+def get_gateway(api_key=None):
+    return resource("gateway", lambda: Gateway(make_backend(LLM_BACKEND, api_key=api_key), metrics=get_metrics()))
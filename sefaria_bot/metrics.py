@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sefaria_bot.resources import resource
+
+
+# JSONL log with one event per LLM call, Sefaria fetch and analysis cache hit; unset (the default) to keep no log.
+# It is never rotated, point it at a file that logrotate (or you) looks after
+METRICS_LOG_PATH = os.getenv("SEFARIA_METRICS_LOG", "")
+
+# Port of the Prometheus /metrics endpoint each app process serves; unset to disable
+METRICS_PORT = int(os.getenv("SEFARIA_METRICS_PORT", "0"))
+
+# USD per million input, cached input and output tokens; models missing here are logged with no cost
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-3.5-turbo": (0.50, 0.50, 1.50),
+}
+
+# The Batch API bills half the price
+BATCH_DISCOUNT = 0.5
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+
+
+# Estimated cost in USD of a call; the API reports dated model names (gpt-4o-mini-2024-07-18) so the longest known prefix is priced
+def estimate_cost(model, prompt_tokens, cached_tokens, completion_tokens, batch=False):
+    known = [name for name in MODEL_PRICES if model == name or model.startswith(name + "-")]
+    if not known:
+        return None
+    input_price, cached_price, output_price = MODEL_PRICES[max(known, key=len)]
+    cost = ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1e6
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+class _Histogram:
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+
+
+# Process-wide metrics: aggregated counters and latency histograms for Prometheus, and every event in the JSONL log.
+# Prometheus labels are section, model and status (refs would make too many series); the log has the ref too.
+class Metrics:
+
+    def __init__(self, log_path=METRICS_LOG_PATH):
+        self.log_path = log_path
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._log_file = None
+        if log_path:
+            if os.path.dirname(log_path):
+                os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            # Opened once and line-buffered, so an event costs one write, not an open and close under the lock
+            self._log_file = open(log_path, "a", encoding="utf-8", buffering=1)
+
+    def _count(self, name, labels, value=1):
+        key = (name, tuple(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def _observe(self, name, labels, value):
+        key = (name, tuple(labels))
+        if key not in self.histograms:
+            self.histograms[key] = _Histogram()
+        self.histograms[key].observe(value)
+
+    def _log(self, event):
+        if self._log_file is not None:
+            self._log_file.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    # One LLM call: seconds waiting for the rate limiter, to the first token (streamed calls) and in total, its tokens and cost
+    def record_call(self, section, ref, model, status, queue_seconds, ttft_seconds, total_seconds,
+                    prompt_tokens=0, cached_tokens=0, completion_tokens=0, attempts=1, batch=False):
+        cost = estimate_cost(model, prompt_tokens, cached_tokens, completion_tokens, batch)
+        event = {
+            "ts": time.time(),
+            "kind": "llm",
+            "section": section,
+            "ref": ref,
+            "model": model,
+            "status": status,
+            "attempts": attempts,
+            "batch": batch,
+            "queue_seconds": queue_seconds,
+            "ttft_seconds": ttft_seconds,
+            "total_seconds": total_seconds,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_usd": cost,
+        }
+        labels = [("section", section), ("model", model)]
+        with self._lock:
+            self._count("sefaria_llm_calls_total", labels + [("status", status)])
+            for stage, seconds in (("queue", queue_seconds), ("ttft", ttft_seconds), ("total", total_seconds)):
+                if seconds is not None:
+                    self._observe("sefaria_llm_seconds", labels + [("stage", stage)], seconds)
+            for kind, tokens in (("input", prompt_tokens), ("cached", cached_tokens), ("output", completion_tokens)):
+                self._count("sefaria_llm_tokens_total", labels + [("type", kind)], tokens)
+            if cost is not None:
+                self._count("sefaria_llm_cost_usd_total", labels, cost)
+            self._log(event)
+
+    # One Sefaria fetch (served from the text cache or downloaded)
+    def record_fetch(self, ref, status, seconds):
+        with self._lock:
+            self._count("sefaria_fetch_total", [("status", status)])
+            self._observe("sefaria_fetch_seconds", [("status", status)], seconds)
+            self._log({"ts": time.time(), "kind": "fetch", "ref": ref, "status": status, "total_seconds": seconds})
+
+    # One analysis step answered from the shared analysis cache instead of the LLM
+    def record_cache_hit(self, section, ref):
+        with self._lock:
+            self._count("sefaria_analysis_cache_hits_total", [("section", section)])
+            self._log({"ts": time.time(), "kind": "cache_hit", "section": section, "ref": ref})
+
+    # The metrics in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(f"{name}{{{_labels(labels)}}} {value:g}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (histogram, labels), values in sorted(self.histograms.items()):
+                    if histogram != name:
+                        continue
+                    for bound, count in zip(LATENCY_BUCKETS, values.counts):
+                        lines.append(f"{name}_bucket{{{_labels(labels + (('le', f'{bound:g}'),))}}} {count}")
+                    lines.append(f"{name}_bucket{{{_labels(labels + (('le', '+Inf'),))}}} {values.count}")
+                    lines.append(f"{name}_sum{{{_labels(labels)}}} {values.sum:g}")
+                    lines.append(f"{name}_count{{{_labels(labels)}}} {values.count}")
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.server.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Serve /metrics on a background thread (port 0 picks a free port); returns the server
+def start_metrics_server(metrics, port=METRICS_PORT, host="0.0.0.0"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _start_metrics():
+    metrics = Metrics()
+    if METRICS_PORT:
+        try:
+            start_metrics_server(metrics)
+        except OSError as e:
+            # Another app process on this machine already serves the port
+            print(f"Metrics endpoint not started on port {METRICS_PORT}: {e}", file=sys.stderr)
+    return metrics
+
+# Process-wide metrics; the first call also starts the /metrics endpoint when SEFARIA_METRICS_PORT is set
+def get_metrics():
+    return resource("metrics", _start_metrics)
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# Per-section latency, tokens and cost from an event log, slowest sections first
+def summarize(path, out=sys.stdout):
+    sections = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            event = json.loads(line)
+            # Batch answers have no latency of their own
+            if event["kind"] == "llm" and event["status"] == "ok" and not event.get("batch"):
+                sections.setdefault(event["section"], []).append(event)
+            elif event["kind"] == "fetch":
+                sections.setdefault("(sefaria fetch)", []).append(event)
+    rows = []
+    for section, events in sections.items():
+        totals = [event["total_seconds"] for event in events]
+        ttfts = [event["ttft_seconds"] for event in events if event.get("ttft_seconds") is not None]
+        rows.append((
+            _percentile(totals, 0.95), section, len(events), _percentile(totals, 0.5),
+            _percentile(ttfts, 0.95) if ttfts else None,
+            sum(event.get("prompt_tokens", 0) + event.get("completion_tokens", 0) for event in events),
+            sum(event.get("cost_usd") or 0 for event in events),
+        ))
+    print(f"{'section':<18} {'calls':>6} {'p50 s':>7} {'p95 s':>7} {'p95 ttft':>9} {'tokens':>9} {'cost $':>9}", file=out)
+    for p95, section, calls, p50, ttft, tokens, cost in sorted(rows, reverse=True):
+        ttft = f"{ttft:9.2f}" if ttft is not None else f"{'-':>9}"
+        print(f"{section:<18} {calls:>6} {p50:7.2f} {p95:7.2f} {ttft} {tokens:>9} {cost:9.4f}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize the LLM call log per section: latency percentiles, tokens and cost.")
+    parser.add_argument("log", nargs="?", default=METRICS_LOG_PATH, help="event log (default: $SEFARIA_METRICS_LOG)")
+    args = parser.parse_args(argv)
+    if not args.log:
+        parser.error("no event log given, and SEFARIA_METRICS_LOG is not set")
+    summarize(args.log)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import json
+import mmap
+import os
+import sys
+
+from sefaria_bot.refs import InvalidRef, canonical_ref, parse_ref
+from sefaria_bot.resources import resource
+
+
+# Path of a local Sefaria export; when set, texts are served from it instead of the Sefaria API
+OFFLINE_CORPUS_PATH = os.getenv("SEFARIA_OFFLINE_CORPUS")
+
+# Version of the saved index layout; an index saved by another version is rebuilt
+_INDEX_VERSION = 2
+
+
+# Read-only view of a local Sefaria export, served through mmap so the corpus is never loaded into RAM
+# and every worker process shares the same page cache. Two layouts are supported:
+#  - .jsonl: one /api/texts/-shaped JSON object per line, with its 'ref'
+#  - .tsv: one segment per row, 'ref<TAB>hebrew<TAB>english', segments of a chapter on consecutive rows
+class OfflineCorpus:
+
+    def __init__(self, path):
+        self.path = path
+        self.format = 'tsv' if path.endswith('.tsv') else 'jsonl'
+        self.index = self._load_index()
+        self.titles = {parse_ref(ref).title for ref in self.index}
+        self._warned = set()
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b''
+
+    # The ref -> (offset, length) index is built once and kept next to the export
+    def _load_index(self):
+        stat = os.stat(self.path)
+        index_path = self.path + '.idx.json'
+        try:
+            with open(index_path, encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('version') == _INDEX_VERSION and saved['size'] == stat.st_size and saved['mtime'] == stat.st_mtime:
+                return {ref: tuple(span) for ref, span in saved['refs'].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+
+        index = self._build_index()
+        try:
+            with open(index_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': _INDEX_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime, 'refs': index}, f, ensure_ascii=False)
+        except OSError:
+            # A read-only corpus directory only costs us rebuilding the index on the next start
+            pass
+        return index
+
+    def _build_index(self):
+        index = {}
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    ref = self._line_ref(line) if line.strip() else None
+                except (InvalidRef, ValueError, KeyError):
+                    # Rows for refs we can't parse could never be asked for
+                    ref = None
+                if ref is not None:
+                    if self.format == 'tsv' and ref in index and sum(index[ref]) == offset:
+                        # Next segment of the same chapter: extend its span
+                        index[ref] = (index[ref][0], index[ref][1] + len(line))
+                    else:
+                        index[ref] = (offset, len(line))
+                offset += len(line)
+        return index
+
+    def _line_ref(self, line):
+        if self.format == 'tsv':
+            return _chapter(parse_ref(line.split(b'\t', 1)[0].decode('utf-8')))[0].canonical
+        return canonical_ref(json.loads(line)['ref'])
+
+    def __contains__(self, ref):
+        try:
+            return canonical_ref(ref) in self.index
+        except InvalidRef:
+            return False
+
+    # Returns an /api/texts/-shaped payload for the ref, or None if the export doesn't have it
+    def get(self, ref):
+        try:
+            key = canonical_ref(ref)
+        except InvalidRef:
+            return None
+        span = self.index.get(key)
+        if span is None:
+            self._warn_missing(key)
+            return None
+        offset, length = span
+        block = self._map[offset:offset + length].decode('utf-8')
+        if self.format == 'jsonl':
+            return json.loads(block)
+
+        he, en = [], []
+        for row in block.splitlines():
+            columns = row.split('\t')
+            # The levels between the chapter and the segment ('Shmatta 1:2:3' is paragraph 3 of its chapter 2) nest
+            # the segments like Sefaria does
+            path = _chapter(parse_ref(columns[0]))[1]
+            he.append((path, columns[1] if len(columns) > 1 else ''))
+            en.append((path, columns[2] if len(columns) > 2 else ''))
+        return {'ref': key, 'he': _nest(he), 'text': _nest(en)}
+
+    # A book the export has rows for, but not this ref of it: said once per ref, as the rows may be keyed another way than the app asks
+    def _warn_missing(self, key):
+        title = parse_ref(key).title
+        if title in self.titles and key not in self._warned:
+            self._warned.add(key)
+            print(f"Offline corpus {self.path} has rows for {title} but none for '{key}'", file=sys.stderr)
+
+    def close(self):
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+
+# The chapter-level Ref a segment ref belongs to, and the levels between that chapter and the segment.
+# The chapter is what the app and prefetching ask for: the first section of an offered book ('Shev Shmateta, Shmatta 1'
+# for 'Shev Shmateta, Shmatta 1:2:3'), or everything but the segment for other books ('Zohar 1:15a' for 'Zohar 1:15a:3')
+def _chapter(ref):
+    levels = 1 if ref.book is not None else max(1, len(ref.start) - 1)
+    return ref._replace(start=ref.start[:levels], end=ref.start[:levels]), ref.start[levels:-1]
+
+
+# Nest (path, segment) rows into lists, one level per element of their paths
+def _nest(rows):
+    if all(not path for path, segment in rows):
+        return [segment for path, segment in rows]
+    groups = []
+    for path, segment in rows:
+        if not groups or groups[-1][0] != path[:1]:
+            groups.append((path[:1], []))
+        groups[-1][1].append((path[1:], segment))
+    return [_nest(group) for first, group in groups]
+
+
+# Process-wide offline corpus, or None when the apps should use the live Sefaria API
+def get_offline_corpus():
+    if OFFLINE_CORPUS_PATH is None:
+        return None
+    return resource("offline_corpus", lambda: OfflineCorpus(OFFLINE_CORPUS_PATH))
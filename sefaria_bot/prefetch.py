@@ -0,0 +1,77 @@
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from sefaria_bot.books import BOOKS, book_refs
+from sefaria_bot.sefaria import is_cached, prefetch_texts
+
+
+# Spaces out request starts so that all workers together stay under a given rate
+class RateLimiter:
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second > 0 else 0
+        self.next_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+# Download every ref of the given books into the text cache; refs already cached are skipped, so an interrupted run can simply be restarted
+def prefetch(books, workers=4, per_second=4.0, force=False, out=sys.stdout):
+    refs = [ref for book in books for ref in book_refs(BOOKS[book])]
+    limiter = RateLimiter(per_second)
+
+    def download(ref):
+        if not force and is_cached(ref):
+            return 0
+        limiter.wait()
+        return prefetch_texts(ref, force=force)
+
+    started = time.monotonic()
+    downloaded_refs = skipped_refs = failed_refs = downloaded_bytes = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(download, ref): ref for ref in refs}
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            if result is None:
+                failed_refs += 1
+                print(f"failed: {futures[future]}", file=out)
+            elif result == 0:
+                skipped_refs += 1
+            else:
+                downloaded_refs += 1
+                downloaded_bytes += result
+            elapsed = max(time.monotonic() - started, 1e-9)
+            if done % 20 == 0 or done == len(refs):
+                print(f"{done}/{len(refs)} refs | {downloaded_refs / elapsed:.1f} refs/s | {downloaded_bytes / elapsed / 1024:.1f} KiB/s", file=out)
+
+    elapsed = time.monotonic() - started
+    print(f"done in {elapsed:.1f}s: {downloaded_refs} downloaded ({downloaded_bytes / 1024:.0f} KiB), {skipped_refs} already cached, {failed_refs} failed", file=out)
+    return failed_refs == 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download whole books from Sefaria into the local text cache.")
+    parser.add_argument("books", nargs="*", default=list(BOOKS), help=f"books to download (default: all of {', '.join(BOOKS)})")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent downloads (default: 4)")
+    parser.add_argument("--rate", type=float, default=4.0, help="maximum requests per second to Sefaria (default: 4)")
+    parser.add_argument("--force", action="store_true", help="download again refs that are already cached")
+    args = parser.parse_args(argv)
+
+    unknown = [book for book in args.books if book not in BOOKS]
+    if unknown:
+        parser.error(f"unknown book(s): {', '.join(unknown)}")
+    return 0 if prefetch(args.books, args.workers, args.rate, args.force) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
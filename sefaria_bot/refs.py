@@ -0,0 +1,151 @@
+import re
+from collections import namedtuple
+
+from sefaria_bot.books import BOOKS
+
+
+# Raised for refs that can't name a Sefaria text, before any network call is made
+class InvalidRef(ValueError):
+    pass
+
+
+# A parsed ref: the book (a Book from sefaria_bot.books, or None for books the app doesn't offer),
+# the Sefaria title, and the first and last sections as tuples ('1', '3') of chapter/daf and segment numbers
+class Ref(namedtuple("Ref", ["book", "title", "start", "end"])):
+
+    __slots__ = ()
+
+    # Key used by every cache and in the Sefaria API URL: 'Genesis 1:1-5', 'Tikkunei Zohar 17a', 'Shev Shmateta, Shmatta 1'
+    @property
+    def canonical(self):
+        return f"{self.title} {self._sections()}" if self.start else self.title
+
+    # Label shown to the user: 'Genesis, 1', 'Shev Shmayasa, 1'
+    @property
+    def display(self):
+        name = self.book.name if self.book is not None else self.title
+        return f"{name}, {self._sections()}" if self.start else name
+
+    @property
+    def is_range(self):
+        return self.end != self.start
+
+    def _sections(self):
+        start = ':'.join(self.start)
+        if not self.is_range:
+            return start
+        # Only write the part of the end that differs: 'Genesis 1:1-5', 'Genesis 1:1-2:3', 'Genesis 1-2'
+        common = 0
+        while common < len(self.start) - 1 and self.start[common] == self.end[common]:
+            common += 1
+        return f"{start}-{':'.join(self.end[common:])}"
+
+    def __str__(self):
+        return self.canonical
+
+
+# Every accepted spelling of an offered book, longest first so 'Shev Shmateta, Shmatta' wins over 'Shev Shmateta'
+_ALIASES = sorted(
+    ((alias.lower(), book) for book in BOOKS.values() for alias in (book.title, book.name) + book.aliases),
+    key=lambda item: -len(item[0]),
+)
+
+# Any level may carry an amud ('Zohar 1:15a'); which levels really can is checked against the book when it is known
+_SECTION = r'\d+[ab]?'
+_LEVELS = rf'{_SECTION}(?::{_SECTION})*'
+_SECTIONS_RE = re.compile(rf'^({_LEVELS})(?:-({_LEVELS}))?$', re.IGNORECASE)
+_TRAILING_SECTIONS_RE = re.compile(rf'^(.*?)[ ,]+({_LEVELS}(?:-{_LEVELS})?)$', re.IGNORECASE)
+
+
+def _normalize(text):
+    text = re.sub(r'[_\s]+', ' ', text).strip()
+    # Sefaria's URL form 'Genesis.1.5' is 'Genesis 1:5'
+    dotted = re.match(r'^(.*?[A-Za-z])\.(\d+[ab]?(?:\.\d+[ab]?)*)$', text)
+    if dotted:
+        text = f"{dotted.group(1)} {dotted.group(2).replace('.', ':')}"
+    return text
+
+
+# Function to turn any accepted spelling of a ref into a Ref
+def parse_ref(text):
+    if not isinstance(text, str) or not text.strip():
+        raise InvalidRef("Empty ref")
+    text = _normalize(text)
+
+    lowered = text.lower()
+    for alias, book in _ALIASES:
+        if lowered == alias or (lowered.startswith(alias) and lowered[len(alias)] in ' ,'):
+            rest = text[len(alias):].strip(' ,')
+            # 'Shev Shmateta, Shmatta 1' and 'Shev Shmayasa 1' are the same section
+            rest = re.sub(r'^shmatta\s*', '', rest, flags=re.IGNORECASE)
+            return _parse_sections(book, book.title, rest, text)
+
+    # A book the app doesn't offer: keep its title as written, still check the sections
+    match = _TRAILING_SECTIONS_RE.match(text)
+    if match:
+        return _parse_sections(None, match.group(1).strip(' ,'), match.group(2), text)
+    if re.search(r'\d', text):
+        raise InvalidRef(f"Can't read the chapter in '{text}'")
+    return Ref(None, text, (), ())
+
+
+def _parse_sections(book, title, sections, text):
+    if not sections:
+        if book is not None:
+            raise InvalidRef(f"Please choose a chapter of {book.name}")
+        return Ref(None, title, (), ())
+    match = _SECTIONS_RE.match(sections)
+    if not match:
+        raise InvalidRef(f"Can't read the chapter in '{text}'")
+
+    start = tuple(match.group(1).lower().split(':'))
+    end = start
+    if match.group(2):
+        end_given = tuple(match.group(2).lower().split(':'))
+        if len(end_given) > len(start):
+            raise InvalidRef(f"The end of '{text}' is more precise than its start")
+        # 'Genesis 1:1-5' ends at 1:5, 'Genesis 1:1-2:3' at 2:3
+        end = start[:len(start) - len(end_given)] + end_given
+
+    for sections_ in (start, end):
+        _check_sections(book, sections_, text)
+    if _sort_key(end) < _sort_key(start):
+        raise InvalidRef(f"'{text}' ends before it starts")
+    return Ref(book, title, start, end)
+
+
+def _check_sections(book, sections, text):
+    first, rest = sections[0], sections[1:]
+    talmud = book is not None and book.address == 'talmud'
+    if talmud and not first[-1] in 'ab':
+        raise InvalidRef(f"'{text}' needs a daf and amud, like 17a")
+    if book is not None and not talmud and not first.isdigit():
+        raise InvalidRef(f"'{text}' needs a chapter number")
+    if book is not None and not all(section.isdigit() for section in rest):
+        raise InvalidRef(f"'{text}' gives an amud where {book.name} has none")
+    if book is not None and len(sections) > book.depth:
+        raise InvalidRef(f"'{text}' goes deeper than {book.name}, whose refs have at most {book.depth} levels")
+    number = int(first.rstrip('ab'))
+    if number < 1 or any(int(section.rstrip('ab')) < 1 for section in rest):
+        raise InvalidRef(f"Sections start at 1 in '{text}'")
+    if book is not None and number > book.sections:
+        raise InvalidRef(f"{book.name} has {book.sections} {'dapim' if talmud else 'chapters'}, '{text}' is out of range")
+
+
+def _sort_key(sections):
+    return tuple((int(section.rstrip('ab')), section[-1] if section[-1] in 'ab' else '') for section in sections)
+
+
+# Function to build the ref of a chapter picked in the "Choose your Text" selector.
+# A Tikkunei Zohar daf given without an amud means its first side, as the app has always done
+def book_ref(name, chapter):
+    book = dict(_ALIASES)[name.lower()]
+    chapter = chapter.strip()
+    if book.address == 'talmud' and chapter.isdigit():
+        chapter += 'a'
+    return parse_ref(f"{book.title} {chapter}")
+
+
+# Turn the different spellings used by the apps ('Shev_Shmateta, Shmatta 1', 'Genesis, 1', 'Genesis  1') into one key
+def canonical_ref(ref):
+    return parse_ref(ref).canonical
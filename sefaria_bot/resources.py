@@ -0,0 +1,56 @@
+import os
+import threading
+from collections import namedtuple
+
+from dotenv import load_dotenv
+
+
+# Settings of the process, read once: OPENAI_API_KEY from the environment or the .env file
+Config = namedtuple("Config", ["openai_api_key"])
+
+
+_resources = {}
+# Reentrant, since building one resource may need another (the gateway needs the metrics)
+_resources_lock = threading.RLock()
+
+# Process-lifetime resource registry: the first caller builds the resource with factory(), every later call (from any
+# rerun of any session) gets the same object. Clients, connection pools, caches and decoded assets all live here.
+def resource(name, factory):
+    value = _resources.get(name)
+    if value is None:
+        with _resources_lock:
+            value = _resources.get(name)
+            if value is None:
+                value = factory()
+                _resources[name] = value
+    return value
+
+
+def _load_config():
+    load_dotenv()
+    return Config(os.getenv("OPENAI_API_KEY"))
+
+# Process-wide settings; the .env file is loaded by the first call only
+def get_config():
+    return resource("config", _load_config)
+
+
+def _decode_image(path):
+    from PIL import Image
+    image = Image.open(path)
+    # Image.open is lazy, decode now so later reruns don't touch the file
+    image.load()
+    return image
+
+# A decoded image asset (e.g. the favicon), opened once per process
+def get_image(path):
+    return resource(("image", path), lambda: _decode_image(path))
+
+
+def _read_asset(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+# The bytes of a static asset (e.g. the logo), read once per process
+def get_asset(path):
+    return resource(("asset", path), lambda: _read_asset(path))
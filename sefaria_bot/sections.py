@@ -0,0 +1,190 @@
+from collections import namedtuple
+
+
+# One LLM step of the analysis. The version is part of the key of cached answers: bump it when a change
+# outside the template (system prompt, pipeline order) should stop old answers from being served.
+# Sections fork from the source text and its translation; depends_on lists the sections whose answers
+# they need to see (to build on them, or not to repeat them).
+Section = namedtuple("Section", ["key", "title", "template", "temperature", "version", "depends_on"])
+
+
+# System prompt every conversation starts with, in the app and in batch precomputation alike
+RABBI_SYSTEM_PROMPT = '''#CONTEXT:
+You are helping students understand a complex philosophical work by making it more accessible to them.
+
+#ROLE:
+You are an English-speaking Jewish Orthodox rabbi.
+
+#RESPONSE GUIDELINES:
+- Avoid explicitly stating your role or the task you are performing or shalom.
+- Always reference the specific text you are working with, if known."
+- Encourage questions and discussion to engage the students with the material.
+- Avoid excessive use of jargon or technical language that may confuse the students.
+- Use bold formatting to emphasize important terms and concepts.
+- God should always be G-d.
+- Hebrew names should be used (if possible); so Moses is Moshe, Aaron is Aharon.
+- Never imply that we're evaluating the work, that would be inappropriate. It's not for us to judge, just to learn and apply.
+- The usage in English translations of Moshe or Aharon instead of Moses or Aaron is called transliteration. Transliteration is the process of transferring a word from one alphabet or writing system to another, typically by representing each letter or character with a corresponding one from the target language. In this case, "Moshe" and "Aharon" are transliterations of the Hebrew names "מֹשֶׁה" and "אַהֲרֹן", respectively, using the Latin alphabet. This is in contrast to translation, which focuses on conveying the meaning of the word, rather than just its sound or spelling. Always use transliteration for Jewish names.
+- All answers should reflect the values, traditions, and norms of the Jewish community, maintaining a focus on Jewish law (Halakha), ethics, and worldview.
+- Respect for Jewish Legal Authority: The discussions should be in line with rabbinic authority and respect the integrity of Jewish legal tradition. It should avoid framing Jewish texts or concepts in ways that contradict or diverge from established halakhic or communal standards.
+- Cultural and Religious Relevance: The discussions should ensure that its insights and discussions are meaningful and applicable to Jewish individuals, families, and communities, keeping its application grounded in the needs and values of the Jewish context.
+- Insular or Exclusive Approach: The discussions should suggest an exclusive focus on Jewish legal and ethical discourse within the Jewish community, avoiding broader external debates or viewpoints that aren't relevant to internal Jewish life.
+'''
+
+# Prompt templates: {ref} is the ref as shown to the user, {text} the text to rewrite or translate
+REWRITE_TEMPLATE = '''This text is {ref}. Re-write the following text in hebrew, avoiding repetition. Here is the text: \n{text}. Please, skip lines when appropriate.  Do not use bold or italic font, do not say what you have done, do not say anaything else. Respond with only the re-written text. '''
+
+TRANSLATION_TEMPLATE = ''' Translate the following text to english, always using transliteration for Jewish names:\n{text}\n. Answer only with the translated text. Do not say anything else, do not say what you have done.'''
+
+SUMMARY_TEMPLATE = '''#CONTEXT:
+This Section is called 'Summary'.
+This is the first section in a Jewish Texts analysis app.
+The task is to analyze a given text and provide a brief overview focusing on the central philosophical question or problem addressed in the text: {ref}. Always provide new and original information, never repeat what you have said in previous sections. Answer only with the summary, do not say anything else, do not say what you have done.'
+
+#Task:
+1. Identify the central philosophical question or problem addressed in the text'
+2. Provide a brief overview of the text in one paragraph.
+3. Use emojis throughout the overview to make it more engaging and fun.
+4. Avoid using emojis in any further interactions beyond the overview.
+5. Answer only with the overview, without adding any additional information or explanations.'''
+
+BACKGROUND_TEMPLATE = '''#CONTEXT:
+This Section is called 'Backgound Information'.
+This is the second section in a Jewish Texts analysis app.
+The task is to provide backgound information on the text: {ref}'. Always provide new and original information, never repeat what you have said in previous sections. Answer only with the backgound information, do not say anything else, do not say what you have done.
+
+#Task:
+1. Book Overview: A brief summary of the book’s plot, themes, and purpose to give insight into how the chapter fits within the broader narrative or argument.
+2. Chapter Placement: How the chapter fits into the structure of the book—whether it introduces key ideas, builds on previous chapters, or concludes a part of the story or argument.
+3. Character or Theme Development: If relevant, how the chapter advances the development of characters, themes, or ideas within the book.
+4. Author’s Intentions: Information on the author’s motivations or intended messages in that specific chapter.
+5. Relevance to Overall Themes: Explanation of how the chapter supports or contrasts with the central themes or messages of the book.
+6. Literary Devices or Style: Notable techniques or styles used by the author in that chapter (e.g., symbolism, foreshadowing, tone) '''
+
+BREAKDOWN_TEMPLATE = '''#CONTEXT:
+This Section is called 'Breakdown of Key Sections'.
+This is the third section in a Jewish Texts analysis app.
+The task is to identify key sections of {ref}. Always provide new and original information, never repeat what you have said in previous sections. Answer only with the breakdown of key sections, do not say anything else, do not say what you have done.
+
+#Task:
+1. Main Idea: Summarize the main idea in 1-2 sentences.
+2. Important Terminology or Concepts: Identify and define any crucial terminology or concepts introduced.
+3. Relation to Overall Argument: Explain how this section or argument contributes to the overall thesis of the text.'''
+
+SIMPLIFY_TEMPLATE = '''#CONTEXT:
+This Section is called 'Simplification of Challenging Passages'.
+This is the fourth section in a Jewish Texts analysis app.
+The user finds this passage difficult: \n'{passage}'\n in the text \n'{ref}'\n The task is to simplify a challenging passage provided by the user. Always provide new and original information, never repeat what you have said in previous sections. Answer only with the simplification of challenging passages, do not say anything else, do not say what you have done.
+
+Task:
+1. Locate the appropriate passage in the text
+2. Provide simplified explanations of this passage to aid understanding.'''
+
+IDENTIFY_TEMPLATE = '''#CONTEXT:
+This Section is called 'Identification of Core Arguments'.
+This is the fifth section in a Jewish Texts analysis app.
+The task is to identifying and summarizing the core arguments presented in the text {ref}. Always provide new and original information, never repeat what you have said in previous sections. Answer only with the identification of core arguments, do not say anything else, do not say what you have done.
+
+    #TASK:
+1. Focus on identifying and summarizing the core arguments presented in the text
+2. Provide clear explanations of the reasoning behind each argument
+3. Discuss the significance and implications of the arguments in the context of Jewish philosophy
+4. Avoid going into excessive detail or tangents unrelated to the core arguments
+5. Use clear and concise language that is accessible to readers with varying levels of familiarity with Jewish philosophy
+'''
+
+FLOW_TEMPLATE = "This Section is called 'Logical Connections Between Core Arguments'. Trace and elucidate the logical flow that binds the arguments presented in the text {ref}, noting how each premise builds upon the other and the logical operations employed (e.g., deduction, induction). Do not say what you have done. Do not repeat what you have said before."
+
+CRITICISM_TEMPLATE = '''This Section is called 'Challenges of Core Arguments'
+    #Evaluate Strengths
+   - Discuss the strengths of each core argument presented in the text {ref}
+   - Consider the logic, evidence, and reasoning used to support the arguments
+
+#Assess Weaknesses
+   - Identify any weaknesses or flaws in the core arguments
+   - Analyze potential counterarguments or alternative perspectives
+
+#Implications and Significance
+   - Discuss the implications of the core arguments within the context of Jewish philosophy
+   - Consider the potential impact or significance of the arguments on the field
+
+#JEWISH PHILOSOPHICAL TEXT CRITERIA
+    - Focus on the central arguments and claims made by the author
+    - Consider the text within the broader context of Jewish philosophical thought
+    - Avoid personal opinions or biases; maintain a scholarly and objective tone internal to the jewish community
+    - Use clear and concise language to convey your critical analysis
+    - Use bullet points or numbered lists to present key points within each section
+    - Use proper formatting for any quotes or references to the original text
+    - Maintain a professional and scholarly tone throughout the analysis
+'''
+
+COUNTER_TEMPLATE = '''This Section is called 'Alternate Viewpoints'
+    - Provide at least three alternative viewpoints on the text {ref}, each representing a different school of thought or interpretation method within Jewish philosophy.
+- For each viewpoint, explain the key arguments, assumptions, and conclusions drawn from the text.
+- Analyze the strengths and weaknesses of each viewpoint, considering factors such as logical consistency, textual evidence, and compatibility with other Jewish teachings.
+- Conclude by synthesizing the insights gained from the different viewpoints and offering a balanced, nuanced understanding of the text's meaning and significance.
+- Focus on the text's central themes, arguments, and concepts, rather than minor details or tangential issues.
+ Consider the text's place within the broader context of Jewish thought and its relationship to other Jewish philosophical works.
+- Avoid imposing modern or non-Jewish philosophical frameworks onto the text; instead, strive to understand it on its own terms and within its historical and cultural context.
+- Engage with the text critically and analytically, but also with respect and sensitivity to its religious and cultural significance.'''
+
+IMPACT_TEMPLATE = '''This Section is called 'Impact of the Text on Philosophical Thought'
+    #RESPONSE GUIDELINES:
+- Explain this in a way to make it fun and intriguing to discuss at a Shabbat dinner
+- Analyze how the text {ref} builds upon, challenges, or diverges from existing philosophical traditions
+- Discuss the novel contributions the text makes to Jewish philosophical thought
+- Examine the broader philosophical implications and significance of the text's ideas
+- Evaluate the text's lasting impact and influence on subsequent philosophical works and thinkers
+- Offer a critical assessment of the text's strengths, limitations, and potential areas for further exploration
+
+#TASK CRITERIA:
+1. Focus on the philosophical content and arguments rather than biographical details of the author
+2. Situate the text within the broader context of Jewish philosophical traditions and debates
+3. Highlight the text's original insights and contributions to philosophical discourse
+4. Use specific examples and passages from the text to support your analysis
+5. Avoid excessive jargon and strive for clarity in explaining complex philosophical concepts
+6. Maintain an objective and balanced perspective, acknowledging both the text's merits and potential criticisms
+
+#RESPONSE FORMAT:
+- Use clear headings and subheadings to organize your analysis
+- Provide a brief introduction outlining the text's main themes and arguments
+- Dedicate separate sections to discussing the text's philosophical contributions, implications, and impact
+- Conclude several ways to use this text to inspire a Shabbat table converstaion'''
+
+
+# Every step, in the order the app runs them
+SECTIONS = {
+    "rewrite": Section("rewrite", "Hebrew Rewrite", REWRITE_TEMPLATE, 1, 1, ()),
+    "translation": Section("translation", "Translation", TRANSLATION_TEMPLATE, 0.5, 1, ()),
+    "summary": Section("summary", "Summary", SUMMARY_TEMPLATE, 1, 2, ()),
+    "background": Section("background", "Background Information", BACKGROUND_TEMPLATE, 1, 2, ()),
+    "breakdown": Section("breakdown", "Breakdown of Key Sections", BREAKDOWN_TEMPLATE, 1, 2, ()),
+    "simplify": Section("simplify", "Simplification of Challenging Passages", SIMPLIFY_TEMPLATE, 1, 2, ()),
+    "identify": Section("identify", "Identification and Summary of Core Arguments", IDENTIFY_TEMPLATE, 1, 2, ()),
+    "flow": Section("flow", "Logical Connections Between Core Arguments", FLOW_TEMPLATE, 0.5, 2, ('identify',)),
+    "criticism": Section("criticism", "Challenges of Core Arguments", CRITICISM_TEMPLATE, 0.5, 2, ('identify',)),
+    "counter": Section("counter", "Alternative Viewpoints", COUNTER_TEMPLATE, 0.5, 2, ('identify',)),
+    "impact": Section("impact", "Impact of the Text on Philosophical Thought", IMPACT_TEMPLATE, 0.5, 2, ()),
+}
+
+
+# Steps whose exchange carries the source text: every section forks from them, and they are never compacted away
+BASE_SECTIONS = ('rewrite', 'translation')
+
+# Sections generated without any input from the user (simplify needs a passage)
+ANALYZE_ALL_SECTIONS = ('summary', 'background', 'breakdown', 'identify', 'flow', 'criticism', 'counter', 'impact')
+
+
+# The sections a section needs, directly or through another one, each before the sections that need it
+def all_dependencies(key):
+    ordered = []
+    for dependency in SECTIONS[key].depends_on:
+        for needed in all_dependencies(dependency) + [dependency]:
+            if needed not in ordered:
+                ordered.append(needed)
+    return ordered
+
+
+# The prompt of one section for a given ref (and passage, or text for rewrite/translation)
+def render_section(key, **values):
+    return SECTIONS[key].template.format(**values)
@@ -0,0 +1,189 @@
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import requests
+
+from sefaria_bot.cache import get_cache
+from sefaria_bot.cleaning import clean_hebrew_text
+from sefaria_bot.offline import get_offline_corpus
+from sefaria_bot.refs import InvalidRef, canonical_ref, parse_ref
+from sefaria_bot.text import SegmentedText
+from sefaria_bot.transport import CONNECT_TIMEOUT, get_transport
+
+
+# Sefaria API URL (point it at `python -m sefaria_bot.stub_server` for offline tests and benchmarks)
+SEFARIA_API_URL = os.getenv("SEFARIA_API_URL", "https://www.sefaria.org/api/texts/")
+
+# When we already hold a stale copy, don't wait longer than this for Sefaria to revalidate it
+STALE_REVALIDATE_TIMEOUT = 2.0
+
+
+# Function to fetch the raw /api/texts/ payload, going through the shared on-disk cache.
+# Returns None for refs that don't parse, without any network call
+def fetch_texts(ref):
+    try:
+        key = canonical_ref(ref)
+    except InvalidRef:
+        return None
+
+    # Offline mode: serve from the local Sefaria export and never touch the network
+    corpus = get_offline_corpus()
+    if corpus is not None:
+        return corpus.get(key)
+
+    cache = get_cache()
+    entry = cache.get(key)
+    if entry is not None and cache.is_fresh(entry):
+        return entry.payload
+    return _download(key, entry)[0]
+
+
+# Whether a fresh copy of a ref is already in the cache
+def is_cached(ref):
+    cache = get_cache()
+    entry = cache.get(canonical_ref(ref))
+    return entry is not None and cache.is_fresh(entry)
+
+
+# Function to download a ref into the cache unless a fresh copy is already there; returns the bytes downloaded
+def prefetch_texts(ref, force=False):
+    key = canonical_ref(ref)
+    cache = get_cache()
+    entry = cache.get(key)
+    if entry is not None and cache.is_fresh(entry) and not force:
+        return 0
+    data, downloaded = _download(key, None if force else entry)
+    if data is None:
+        return None
+    return downloaded
+
+
+# Revalidates (or fetches) a canonical ref and stores the answer; returns the payload and the number of bytes received
+def _download(key, entry):
+    cache = get_cache()
+    headers = {}
+    if entry is not None and entry.etag:
+        headers['If-None-Match'] = entry.etag
+    if entry is not None and entry.last_modified:
+        headers['If-Modified-Since'] = entry.last_modified
+
+    url = f"{SEFARIA_API_URL}{key}"
+    try:
+        if entry is not None:
+            response = get_transport().get(url, headers=headers, timeout=(CONNECT_TIMEOUT, STALE_REVALIDATE_TIMEOUT), retries=0)
+        else:
+            response = get_transport().get(url, headers=headers)
+    except requests.RequestException:
+        # Sefaria is slow or down: a stale text beats no text
+        if entry is not None:
+            return entry.payload, 0
+        return None, 0
+
+    if response.status_code == 304 and entry is not None:
+        cache.touch(key)
+        return entry.payload, 0
+    if response.status_code == 200:
+        data = response.json()
+        # Sefaria answers unknown or out-of-range refs with an error message, which must not be cached
+        if 'error' in data:
+            return (entry.payload if entry is not None else None), len(response.content)
+        cache.put(key, data, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return data, len(response.content)
+    if entry is not None:
+        return entry.payload, 0
+    return None, 0
+
+
+# Title, source and license of one language version of a text
+Version = namedtuple("Version", ["title", "source", "license"])
+
+# Hebrew and English segments of a ref, as returned by a single /api/texts/ response,
+# with the ref of each Hebrew segment ('Genesis 1:3') in anchors
+TextBundle = namedtuple("TextBundle", ["ref", "he", "en", "he_version", "en_version", "anchors"])
+
+
+# Sefaria returns a plain string for a single segment and nested lists for refs spanning several sections;
+# flatten either into (offsets, segment) pairs, offsets being the segment's 0-based position at each level of nesting
+def _segments(value, offsets=()):
+    if isinstance(value, str):
+        return [(offsets, value)]
+    segments = []
+    for offset, item in enumerate(value or []):
+        segments.extend(_segments(item, offsets + (offset,)))
+    return segments
+
+
+# A section moved on by `steps`: '3' + 2 is '5', and dapim go amud by amud, '2a' + 1 is '2b', '2b' + 1 is '3a'
+def _advance(section, steps):
+    if section[-1] in 'ab':
+        amud = int(section[:-1]) * 2 + (section[-1] == 'b') + steps
+        return f"{amud // 2}{'ab'[amud % 2]}"
+    return str(int(section) + steps)
+
+
+# The ref of one segment of a parsed Ref, from its offsets in the payload. The nesting starts at the level where a
+# range starts to vary, or right below a single section; levels still on the start's branch count from the start
+# ('Genesis 1:30-2:3' begins at verse 30, then chapter 2 at verse 1)
+def _anchor(ref, offsets):
+    level = len(ref.start)
+    if ref.is_range:
+        level = next(i for i in range(len(ref.start)) if ref.start[i] != ref.end[i])
+    sections = list(ref.start[:level])
+    on_start = True
+    for offset in offsets:
+        sections.append(_advance(ref.start[level], offset) if on_start and level < len(ref.start) else str(offset + 1))
+        on_start = on_start and offset == 0
+        level += 1
+    return ref._replace(start=tuple(sections), end=tuple(sections)).canonical
+
+
+# Function to fetch both languages of a ref with one round trip and one JSON parse
+def fetch_bilingual_text(ref):
+    data = fetch_texts(ref)
+    if data is None:
+        return None
+    ref = data.get('ref', canonical_ref(ref))
+    he = _segments(data.get('he', []))
+    try:
+        parsed = parse_ref(ref)
+        anchors = [_anchor(parsed, offsets) for offsets, segment in he]
+    except InvalidRef:
+        # A ref Sefaria names in a way we can't read: anchors are plain segment numbers under it
+        anchors = [f"{ref}:{number}" for number in range(1, len(he) + 1)]
+    return TextBundle(
+        ref=ref,
+        he=[segment for offsets, segment in he],
+        en=[segment for offsets, segment in _segments(data.get('text', []))],
+        he_version=Version(data.get('heVersionTitle'), data.get('heVersionSource'), data.get('heLicense')),
+        en_version=Version(data.get('versionTitle'), data.get('versionSource'), data.get('license')),
+        anchors=anchors,
+    )
+
+
+# Cleaned texts of recently served refs, so a cache hit doesn't pay for the HTML cleaning again
+_cleaned = OrderedDict()
+_cleaned_lock = threading.Lock()
+_CLEANED_MAX_ENTRIES = 256
+
+def _remember_cleaned(key, value):
+    with _cleaned_lock:
+        _cleaned[key] = value
+        _cleaned.move_to_end(key)
+        while len(_cleaned) > _CLEANED_MAX_ENTRIES:
+            _cleaned.popitem(last=False)
+
+
+# Function to fetch the cleaned Hebrew text of a ref, keeping its segments apart
+def fetch_segmented_text(ref):
+    bundle = fetch_bilingual_text(ref)
+    if bundle is None:
+        return None
+    key = canonical_ref(ref)
+    with _cleaned_lock:
+        remembered = _cleaned.get(key)
+    if remembered is not None and remembered[0] == bundle.he:
+        return remembered[1]
+    text = SegmentedText.from_segments(bundle.ref, [clean_hebrew_text([segment]) for segment in bundle.he], bundle.anchors)
+    _remember_cleaned(key, (bundle.he, text))
+    return text
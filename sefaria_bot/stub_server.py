@@ -0,0 +1,189 @@
+import argparse
+import copy
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit
+
+from sefaria_bot.refs import InvalidRef, parse_ref
+
+
+# Sample /api/texts/ responses, one per book the app offers; any chapter of the book is served from it
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BOOK_FIXTURES = {
+    "Shev Shmayasa": "shev_shmateta.json",
+    "Tikkunei Zohar": "tikkunei_zohar.json",
+    "Genesis": "genesis.json",
+}
+
+REAL_SEFARIA_API_URL = "https://www.sefaria.org/api/texts/"
+
+
+def _slug(ref):
+    return re.sub(r'[^A-Za-z0-9]+', '_', ref).strip('_').lower()
+
+
+# Local stand-in for the Sefaria /api/texts/ endpoint, with injectable latency, errors and payload size
+class StubSefariaServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 8765), latency=0.0, jitter=0.0, error_rate=0.0, payload_scale=1,
+                 recordings_dir=None, record=False, seed=None):
+        super().__init__(address, _StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.payload_scale = payload_scale
+        self.recordings_dir = recordings_dir
+        self.record = record
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.requests_served = 0
+        self._fixtures = {}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/texts/"
+
+    def _roll(self):
+        with self.random_lock:
+            return self.random.random(), self.random.uniform(-self.jitter, self.jitter)
+
+    # Recorded response for the ref if there is one, otherwise the book's sample relabelled as the ref
+    def payload(self, ref):
+        if self.recordings_dir:
+            path = os.path.join(self.recordings_dir, _slug(ref.canonical) + ".json")
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    return json.load(f)
+            if self.record:
+                data = self._record(ref, path)
+                if data is not None:
+                    return data
+
+        if ref.book is None:
+            return {"error": f"Sefaria stand-in only serves {', '.join(BOOK_FIXTURES)}, not '{ref.title}'."}
+        name = BOOK_FIXTURES[ref.book.name]
+        if name not in self._fixtures:
+            with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+                self._fixtures[name] = json.load(f)
+        data = copy.deepcopy(self._fixtures[name])
+        data["ref"] = ref.canonical
+        return data
+
+    # Fetch the ref from the real Sefaria API once and keep it for later runs
+    def _record(self, ref, path):
+        from sefaria_bot.transport import get_transport
+        response = get_transport().get(REAL_SEFARIA_API_URL + quote(ref.canonical))
+        if response.status_code != 200:
+            return None
+        data = response.json()
+        if "error" not in data:
+            os.makedirs(self.recordings_dir, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+        return data
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests_served += 1
+        roll, jitter = server._roll()
+        delay = max(0.0, server.latency + jitter)
+        if delay:
+            time.sleep(delay)
+
+        path = urlsplit(self.path).path
+        if not path.startswith("/api/texts/"):
+            return self._send(404, {"error": "Not found"})
+        if roll < server.error_rate:
+            return self._send(503, {"error": "Injected failure"})
+
+        try:
+            ref = parse_ref(unquote(path[len("/api/texts/"):]))
+        except InvalidRef as e:
+            # Sefaria answers bad refs with a 200 and an error message
+            return self._send(200, {"error": str(e)})
+
+        data = server.payload(ref)
+        if server.payload_scale > 1 and "error" not in data:
+            for language in ("he", "text"):
+                if isinstance(data.get(language), list):
+                    data[language] = data[language] * server.payload_scale
+        self._send(200, data)
+
+    def _send(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 200:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Start a stand-in server on a background thread (port 0 picks a free port); returns the server
+def start_stub_server(port=0, **options):
+    server = StubSefariaServer(("127.0.0.1", port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve /api/texts/ responses for the app's books locally, in place of sefaria.org.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="random +/- variation of the delay")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with a 503")
+    parser.add_argument("--payload-scale", type=int, default=1, help="repeat the segments of every text this many times")
+    parser.add_argument("--recordings", help="directory of recorded responses, served in preference to the samples")
+    parser.add_argument("--record", action="store_true", help="fetch refs missing from --recordings from sefaria.org and save them")
+    parser.add_argument("--seed", type=int, help="seed for reproducible latency jitter and error injection")
+    args = parser.parse_args(argv)
+    if args.record and not args.recordings:
+        parser.error("--record needs --recordings")
+
+    server = StubSefariaServer(
+        (args.host, args.port),
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        payload_scale=args.payload_scale,
+        recordings_dir=args.recordings,
+        record=args.record,
+        seed=args.seed,
+    )
+    print(f"Serving Sefaria stand-in, point the apps at it with:\n  SEFARIA_API_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
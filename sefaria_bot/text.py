@@ -0,0 +1,85 @@
+from array import array
+
+
+# A cleaned text that remembers where each Sefaria segment starts and ends.
+# All segments live in one string (joined with single spaces, like the apps have always shown them),
+# and the segment boundaries are two compact arrays of offsets into it, so slicing, chunking and
+# per-segment lookups never need to refetch or re-split the text.
+class SegmentedText:
+
+    __slots__ = ('ref', 'text', 'starts', 'ends', 'anchors')
+
+    def __init__(self, ref, text, starts, ends, anchors):
+        self.ref = ref
+        self.text = text
+        self.starts = starts
+        self.ends = ends
+        self.anchors = anchors
+
+    @classmethod
+    def from_segments(cls, ref, segments, anchors=None):
+        if anchors is None:
+            anchors = [f"{ref}:{number}" for number in range(1, len(segments) + 1)]
+        starts, ends, parts = array('I'), array('I'), []
+        position = 0
+        for segment in segments:
+            # Segments that cleaned down to nothing keep their anchor but add no separator
+            if segment and parts:
+                position += 1
+            starts.append(position)
+            if segment:
+                parts.append(segment)
+                position += len(segment)
+            ends.append(position)
+        return cls(ref, ' '.join(parts), starts, ends, list(anchors))
+
+    def __str__(self):
+        return self.text
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        for i in range(len(self.starts)):
+            yield self.text[self.starts[i]:self.ends[i]]
+
+    # text[i] is the i-th segment; text[i:j] is a SegmentedText of those segments (consecutive ones only, no step)
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            first, last, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("A SegmentedText slice can't have a step")
+            return self.slice(first, last)
+        return self.text[self.starts[index]:self.ends[index]]
+
+    def slice(self, first, last):
+        if first >= last:
+            return SegmentedText(self.ref, '', array('I'), array('I'), [])
+        # Start at the first non-empty segment so the slice doesn't begin with a separator
+        offset = next((self.starts[i] for i in range(first, last) if self.ends[i] > self.starts[i]), self.ends[last - 1])
+        return SegmentedText(
+            self.ref,
+            self.text[offset:self.ends[last - 1]],
+            array('I', (max(start, offset) - offset for start in self.starts[first:last])),
+            array('I', (max(end, offset) - offset for end in self.ends[first:last])),
+            self.anchors[first:last],
+        )
+
+    # Index of the segment with the given ref ('Genesis 1:3'), or None
+    def find(self, anchor):
+        try:
+            return self.anchors.index(anchor)
+        except ValueError:
+            return None
+
+    # Consecutive runs of whole segments of at most max_chars characters each (a longer segment gets a chunk of its own),
+    # e.g. to translate a long daf piece by piece
+    def chunks(self, max_chars):
+        first = 0
+        for i in range(1, len(self) + 1):
+            if i == len(self) or self.ends[i] - self.starts[first] > max_chars:
+                yield self.slice(first, i)
+                first = i
+
+    def __repr__(self):
+        return f"SegmentedText({self.ref!r}, {len(self)} segments, {len(self.text)} characters)"
@@ -0,0 +1,103 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from sefaria_bot.resources import resource
+
+
+# Connect / read timeouts (seconds) for every request to Sefaria
+CONNECT_TIMEOUT = float(os.getenv("SEFARIA_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("SEFARIA_READ_TIMEOUT", "20"))
+
+# How many requests may be in flight to a single host at once
+MAX_PER_HOST = int(os.getenv("SEFARIA_MAX_PER_HOST", "8"))
+
+# Retries on connection errors and 429/5xx answers, with exponential backoff
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+# Caps retries to a fraction of the traffic, so a Sefaria outage doesn't get multiplied by our own retries
+class RetryBudget:
+
+    def __init__(self, ratio=0.2, min_retries=10):
+        self.ratio = ratio
+        self.balance = float(min_retries)
+        self.max_balance = float(min_retries) + 100 * ratio
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.balance >= 1:
+                self.balance -= 1
+                return True
+            return False
+
+
+# Shared keep-alive session with a connection pool and a per-host concurrency cap
+class Transport:
+
+    def __init__(self, max_per_host=MAX_PER_HOST, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), max_retries=MAX_RETRIES):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_per_host = max_per_host
+        self.budget = RetryBudget()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_per_host, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept": "application/json", "User-Agent": "sefaria_bot"})
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+
+    def _slots(self, url):
+        host = urlsplit(url).netloc
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_slots[host]
+
+    # GET with timeouts and bounded retries; returns the last response, or raises the last connection error
+    def get(self, url, headers=None, timeout=None, retries=None):
+        timeout = timeout or self.timeout
+        retries = self.max_retries if retries is None else retries
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            error = None
+            response = None
+            with self._slots(url):
+                try:
+                    response = self.session.get(url, headers=headers, timeout=timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+            if error is None and response.status_code not in RETRY_STATUSES:
+                return response
+            if attempt >= retries or not self.budget.withdraw():
+                if error is not None:
+                    raise error
+                return response
+            attempt += 1
+            time.sleep(self._backoff(attempt, response))
+
+    def _backoff(self, attempt, response):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(BACKOFF_MAX, float(retry_after))
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+# Process-wide transport instance
+def get_transport():
+    return resource("transport", Transport)
@@ -5,6 +5,7 @@ setup(
     version='0.1.0',
     packages=find_packages(),
     include_package_data=True,
+    package_data={'sefaria_bot': ['fixtures/*.json']},
     install_requires=[
         'streamlit==1.38.0',
         'dotenv',